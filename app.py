@@ -2,8 +2,10 @@ import streamlit as st
 from streamlit_ace import st_ace
 import time
 import os
+import threading
+import collections
+import weakref
 import pandas as pd
-from shroomdk import ShroomDK
 from transpose import Transpose
 import requests
 import json
@@ -15,6 +17,18 @@ import matplotlib.ticker as ticker
 import numpy as np
 import plotly.express as px
 
+from figure_cache import cached_figure, default_figure_cache
+from flipside_fetch import FetchState
+from rollups import RollupMaterializer, read_rollup, remote_executor
+from providers import build_router
+from warmup import WARMUP_ON_START, WARMUP_TOP_QUERIES, read_report, record_query, warm_up, write_report
+from sql_rewrite import rewrite
+from sql_validate import validate
+from sharding import OSMOSIS_GENESIS, PARTITION_FREQUENCIES, run_sharded
+from scheduler import EDITOR, default_scheduler
+from session_memory import SessionMemory
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
 # Configure Streamlit Page
 #page_icon = "assets/img/eth.jpg"
 page_icon = "assets/img/osmosis-55faa201.png"
@@ -25,54 +39,230 @@ st.warning(
     "Quickly explore Osmosis blockchain data. For extensive usage, register directly with Flipside, using an amazing guide made by Cordtus [here](https://github.com/osmo-support-lab/guides-and-info/blob/main/readme/interacting-with-osmosis/query-flipside-database.md). The following tool will be on the top side at all times for users to interact better with the queries."
 )
 
+# Editor results kept per session, see pin_result
+PINNED_RESULTS_PER_SESSION = int(os.environ.get("QUERY_OSMOSIS_PINNED_RESULTS", 3))
+
 # Get API Keys
 flipside_key = st.secrets["API_KEY"]
-sdk = ShroomDK(flipside_key)
-
-# Query Flipside using their Python SDK
-def query_flipside(q):
-    sdk = ShroomDK(flipside_key)
-    result_list = []
-    for i in range(1, 11):  # max is a million rows @ 100k per page
-        data = sdk.query(q, page_size=100000, page_number=i)
-        if data.run_stats.record_count == 0:
-            break
-        else:
-            result_list.append(data.records)
-    result_df = pd.DataFrame()
-    for idx, each_list in enumerate(result_list):
-        if idx == 0:
-            result_df = pd.json_normalize(each_list)
-        else:
-            try:
-                result_df = pd.concat([result_df, pd.json_normalize(each_list)])
-            except:
-                continue
-    result_df.drop(columns=["__row_index"], inplace=True)
-    return result_df
-
-
-
-# Provider names mapped to their respective query functions
-def run_query(q, provider):
+
+# Providers are shared by every session in the process. Flipside is the
+# primary; an optional second API key or endpoint is used for hedging and
+# failover, and the local result cache serves as a last resort.
+@st.cache_resource
+def get_provider_router():
+    return build_router(
+        flipside_key,
+        secondary_api_key=st.secrets.get("API_KEY_SECONDARY"),
+        secondary_base_url=st.secrets.get("API_BASE_URL_SECONDARY"),
+        before_page=default_scheduler.page_permit,
+    )
+
+
+# Identifies the browser session for fair queuing in the scheduler
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
+# Provider names mapped to their respective routers. All remote execution
+# goes through the process-wide scheduler, since every session shares the
+# same API key. Passing back an incomplete FetchState resumes it.
+def run_query(q, provider, priority=EDITOR, state=None):
     provider_query = {
-        "Flipside": query_flipside
+        "Flipside": get_provider_router()
     }
-    df = provider_query[provider](q)
-    return df
-    
+    result = default_scheduler.run(
+        lambda: provider_query[provider].execute(q, state=state),
+        session_id=current_session_id(),
+        priority=priority,
+    )
+    return result
+
+
+# Small results are written as-is. Spilled results are shown as a sortable,
+# paginated view that only materializes and sends the visible page.
+def render_result(result, key, page_size=1000):
+    if not result.spilled:
+        st.write(result.to_pandas())
+        return
+    num_pages = max(1, math.ceil(result.num_rows / page_size))
+    col1, col2, col3 = st.columns([3, 1, 1])
+    sort_by = col1.selectbox("Sort by", ["(none)"] + result.columns, key=f"{key}_sort")
+    ascending = col2.checkbox("Ascending", value=True, key=f"{key}_asc")
+    page = col3.number_input("Page", min_value=1, max_value=num_pages, value=1, key=f"{key}_page")
+    page_df = result.page(
+        page - 1,
+        page_size,
+        sort_by=None if sort_by == "(none)" else sort_by,
+        ascending=ascending,
+    )
+    st.dataframe(page_df, use_container_width=True)
+    first_row = (page - 1) * page_size + 1
+    st.caption(f"Rows {first_row}-{first_row + len(page_df) - 1} of {result.num_rows} (page {page} of {num_pages})")
+
+
 ace_query = st_ace(
     language="sql",
     placeholder="select * from osmosis.core.fact_transfers limit 10",
     theme="twilight",
 )
 
+# Process-wide accounting of the results each session holds. Idle sessions,
+# and the least recently seen ones when memory runs short, lose their pinned
+# results and simply run the query again on their next visit.
+@st.cache_resource
+def get_session_memory():
+    return SessionMemory().start()
+
+
+session_memory = get_session_memory()
+session_memory.touch(current_session_id())
+
+
+def _evict_pinned(pinned_ref, key):
+    def evict():
+        pinned = pinned_ref()
+        fetch = pinned.pop(key, None) if pinned is not None else None
+        if fetch is not None:
+            fetch.result.release()
+
+    return evict
+
+
+# Results pinned in session state, keyed by the query and its execution
+# options. Rendering the same pinned frame again produces an identical
+# message, which Streamlit's message cache does not re-send to the browser.
+def pinned_result(key):
+    pinned = st.session_state.setdefault("pinned_results", collections.OrderedDict())
+    if key in pinned:
+        pinned.move_to_end(key)
+        return pinned[key]
+    return None
+
+
+def pin_result(key, fetch):
+    pinned = st.session_state.setdefault("pinned_results", collections.OrderedDict())
+    pinned[key] = fetch
+    session_memory.track(current_session_id(), key, fetch.result.nbytes, _evict_pinned(weakref.ref(pinned), key))
+    while len(pinned) > PINNED_RESULTS_PER_SESSION:
+        evicted_key, evicted = pinned.popitem(last=False)
+        session_memory.untrack(current_session_id(), evicted_key)
+        evicted.result.release()
+
+
+# Run a query split into time partitions. Each partition is queued in the
+# scheduler on its own, so the merged query never holds a slot itself.
+def run_sharded_query(q, provider, time_column, start, frequency):
+    session_id = current_session_id()
+    provider_query = {
+        "Flipside": get_provider_router()
+    }
+
+    def execute(sql):
+        fetch = default_scheduler.run(
+            lambda: provider_query[provider].execute(sql), session_id=session_id, priority=EDITOR
+        )
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.result.to_pandas()
+
+    result, stats = run_sharded(q, execute, time_column=time_column, start=start, frequency=frequency)
+    return FetchState.finished(q, result), stats
+
+
 provider_0 = 'Flipside'
+with st.expander("Sharded execution for large historical scans"):
+    st.write(
+        "Splits the query into date ranges on a time column and runs them in parallel. "
+        "Use `:shard_start` and `:shard_end` in the query to place the range filter yourself; "
+        "otherwise the query is wrapped and filtered on the time column, which needs the placeholders "
+        "when the query has a top-level limit, grouping, DISTINCT or aggregate. "
+        "Ranges that ended more than a day ago are cached and never fetched again."
+    )
+    shard_enabled = st.checkbox("Run sharded", key="shard_enabled")
+    shard_col1, shard_col2, shard_col3 = st.columns(3)
+    shard_time_column = shard_col1.text_input("Time column", value="block_timestamp", key="shard_time_column")
+    shard_start = shard_col2.date_input("From", value=pd.Timestamp(OSMOSIS_GENESIS), key="shard_start")
+    shard_frequency = shard_col3.selectbox("Partition by", list(PARTITION_FREQUENCIES), index=2, key="shard_frequency")
+
+optimize_query = st.checkbox(
+    "Optimize repeated table scans before submitting",
+    key="optimize_query",
+    help="Hoists repeated subqueries and merges subqueries that scan the same table with different filters into a single scan. Filters that use anything but the table's own columns and the query's CTEs are left alone. Review the rewritten SQL before relying on it.",
+)
+
+validate_query = st.checkbox(
+    "Check tables and columns before submitting",
+    value=True,
+    key="validate_query",
+    help="Checks osmosis.core and osmosis.mars tables and columns against the schema data in the sidebar, so typos are reported without a round-trip to Flipside.",
+)
+
+# Queries with unknown tables or qualified columns are rejected locally;
+# tables missing from the schema data and unqualified names that look like
+# misspelled columns are only warned about
+query_validation = validate(ace_query) if ace_query and validate_query else None
+if query_validation is not None:
+    for warning in query_validation.warnings:
+        st.warning(warning)
+    if not query_validation.ok:
+        st.error("The query was not submitted:\n\n" + "\n\n".join(query_validation.errors))
+
 try:
-    if ace_query:
-        results_df = run_query(ace_query, provider_0)
-        st.write(results_df)
-except:
+    if ace_query and (query_validation is None or query_validation.ok):
+        # st_ace keeps returning the last submitted query, so reruns caused
+        # by other widgets find its result pinned and do not execute it again
+        submitted_query = ace_query
+        if optimize_query:
+            rewritten = rewrite(ace_query)
+            if rewritten.changed:
+                submitted_query = rewritten.sql
+                with st.expander("Optimized SQL: " + "; ".join(rewritten.changes)):
+                    st.code(rewritten.diff(), language="diff")
+        # Shard options only count while sharding is on, so editing them
+        # otherwise does not re-run the query
+        fetch_key = (submitted_query,)
+        if shard_enabled:
+            fetch_key += (shard_time_column, str(shard_start), shard_frequency)
+        fetch = pinned_result(fetch_key)
+        if fetch is None:
+            record_query(ace_query)
+            if shard_enabled:
+                fetch, shard_stats = run_sharded_query(
+                    submitted_query, provider_0, shard_time_column, shard_start, shard_frequency
+                )
+                fetch.shard_stats = shard_stats
+            else:
+                fetch = run_query(submitted_query, provider_0)
+            pin_result(fetch_key, fetch)
+        if fetch.error is not None and st.button("Resume fetch", key="editor_resume"):
+            fetch = run_query(submitted_query, provider_0, state=fetch)
+        shard_stats = getattr(fetch, "shard_stats", None)
+        if shard_stats is not None:
+            st.caption(
+                f"{shard_stats['partitions']} partitions: {shard_stats['fetched']} fetched, "
+                f"{shard_stats['cached']} from cache"
+            )
+        if fetch.error is not None:
+            if fetch.missing_pages is None:
+                st.error(f"The query could not be retrieved: {fetch.error.cause}")
+            else:
+                st.warning(
+                    f"Pages {fetch.missing_pages} of {fetch.total_pages} could not be retrieved "
+                    f"({fetch.error.cause}). Showing the rows retrieved so far."
+                )
+        if fetch.truncated_pages:
+            st.warning(
+                f"Pages {fetch.truncated_pages} of {fetch.available_pages} were not retrieved, "
+                f"only the first {fetch.total_pages} pages are fetched. Add a limit or a filter to see every row."
+            )
+        if getattr(fetch, "provider", None) == get_provider_router().cache.name:
+            cache_age = get_provider_router().cache.age(submitted_query)
+            if cache_age is not None:
+                st.caption(f"Served from the local result cache, {cache_age / 60:.0f} minutes old.")
+        render_result(fetch.result, "editor_result")
+except Exception as e:
+    st.error(f"The query failed: {e}")
     st.write("Write a new query.")
     
 st.warning("Please, when using the tool and querying, use simple queries and limit 10 to reduce the querying time, since it is limited!")
@@ -146,6 +336,94 @@ for index, row in provider_tables_df_2.iterrows():
         st.table(columns_df)
 
 
+# Provider health and latency
+with st.sidebar.expander("Providers"):
+    st.table(pd.DataFrame(get_provider_router().status()))
+
+# Shared query scheduler status
+with st.sidebar.expander("Query scheduler"):
+    scheduler_metrics = default_scheduler.metrics()
+    st.write(f"Running: {scheduler_metrics['running']} / {scheduler_metrics['max_concurrent']}")
+    st.write(f"Queued: {scheduler_metrics['queue_depth']}")
+    st.table(pd.DataFrame(
+        {
+            "queued": [scheduler_metrics["dashboard_queue_depth"], scheduler_metrics["editor_queue_depth"]],
+            "wait p50 (s)": [scheduler_metrics["dashboard_wait_p50_s"], scheduler_metrics["editor_wait_p50_s"]],
+            "wait p95 (s)": [scheduler_metrics["dashboard_wait_p95_s"], scheduler_metrics["editor_wait_p95_s"]],
+        },
+        index=["dashboard", "editor"],
+    ))
+
+# Figures shared across sessions, rebuilt only when their data changes
+with st.sidebar.expander("Figure cache"):
+    st.write(default_figure_cache.metrics())
+
+# Admin view of per-session memory, shown with ?debug=1 in the URL
+if st.experimental_get_query_params().get("debug") == ["1"]:
+    with st.sidebar.expander("Session memory", expanded=True):
+        memory_report = session_memory.report()
+        st.write(
+            f"RSS: {memory_report['rss_mb']} MB (ceiling: {memory_report['ceiling_mb'] or 'none'}), "
+            f"pinned results: {memory_report['tracked_mb']} MB, "
+            f"shared figures: {default_figure_cache.metrics()['mb']} MB"
+        )
+        st.dataframe(pd.DataFrame(memory_report["sessions"]), use_container_width=True)
+        if st.button("Evict idle sessions now", key="evict_idle_sessions"):
+            st.write(f"Released {session_memory.sweep() / 2**20:.2f} MB")
+
+# Dashboard charts read from local rollup tables that a background job keeps
+# up to date, so page loads make no remote calls
+@st.cache_resource
+def get_rollup_materializer():
+    return RollupMaterializer(remote_executor(get_provider_router(), default_scheduler))
+
+
+# Process-wide record of the in-app warm-up
+@st.cache_resource
+def get_startup_warmup():
+    return {"lock": threading.Lock(), "report": None}
+
+
+rollup_materializer = get_rollup_materializer()
+if WARMUP_ON_START:
+    startup_warmup = get_startup_warmup()
+    with startup_warmup["lock"]:
+        if startup_warmup["report"] is None:
+            warmup_bar = st.progress(0.0, text="Warming up caches")
+            startup_warmup["report"] = warm_up(
+                rollup_materializer,
+                get_provider_router(),
+                default_scheduler,
+                WARMUP_TOP_QUERIES,
+                progress=lambda done, total, label: warmup_bar.progress(
+                    done / total, text=f"Warming up: {label} ({done}/{total})"
+                ),
+            )
+            write_report(startup_warmup["report"])
+            warmup_bar.empty()
+# Started after the warm-up so both do not refresh the same rollups
+rollup_materializer.start()
+
+
+# Rollups are empty until their first refresh has finished
+def rollup_ready(df):
+    if df.empty:
+        st.info("This chart's data is still being materialized. Refresh the page in a minute.")
+        return False
+    return True
+
+
+last_30_days = pd.Timestamp.utcnow().tz_localize(None).normalize() - pd.Timedelta(days=30)
+
+with st.sidebar.expander("Dashboard rollups"):
+    st.table(rollup_materializer.store.status())
+    warmup_report = read_report()
+    if warmup_report is not None:
+        st.write(
+            f"Last warm-up took {warmup_report['duration_s']}s: "
+            f"{len(warmup_report['tasks'])} tasks, {warmup_report['failed']} failed"
+        )
+
 tab1, tab2, tab3, tab4, tab5  = st.tabs(["Introduction and basics", "SQL and JSON basics", "Osmosis basics", "Osmosis - create a few complex tables", "Flipside docs"])
 
 with tab1:
@@ -338,36 +616,19 @@ with tab3:
     st.write('If we execute and plot the results of the previous statement, we can plot the daily number of IBC transactions in and out of Osmosis from the past 30 days.')
    
     
-    sql0 = """
-       select date_trunc('day', block_timestamp) as date,
-    transfer_type,
-    count(distinct tx_id) as num_tx from osmosis.core.fact_transfers a 
-    where tx_succeeded = 'TRUE'
-    and  date_trunc('day', block_timestamp) >= current_date - 30
-    and transfer_type in ('IBC_TRANSFER_IN','IBC_TRANSFER_OUT')
-    group by date, transfer_type
-
-    
-    """
-    
-    st.experimental_memo(ttl=1000000)
-    @st.experimental_memo
-    def compute(a):
-        results=sdk.query(a)
-        return results
     
-    results0 = compute(sql0)
-    df0 = pd.DataFrame(results0.records)
+    df0 = read_rollup("daily_transfers_by_type", since=last_30_days)
     
-    fig1 = px.bar(df0, x="date", y="num_tx", color="transfer_type", color_discrete_sequence=px.colors.qualitative.Pastel2)
-    fig1.update_layout(
-    title='Daily number of IBC transactions - last 30 days',
-    xaxis_tickfont_size=14,
-    yaxis_tickfont_size=14,
-    bargap=0.15, # gap between bars of adjacent location coordinates.
-    bargroupgap=0.1 # gap between bars of the same location coordinate.
-    )
-    st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
+    if rollup_ready(df0):
+        fig1 = cached_figure("bar", df0, x="date", y="num_tx", color="transfer_type", color_discrete_sequence=px.colors.qualitative.Pastel2,
+        layout=dict(
+        title='Daily number of IBC transactions - last 30 days',
+        xaxis_tickfont_size=14,
+        yaxis_tickfont_size=14,
+        bargap=0.15, # gap between bars of adjacent location coordinates.
+        bargroupgap=0.1 # gap between bars of the same location coordinate.
+        ))
+        st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
  
       
     st.subheader("Daily amount delegated/undelegated/redelegated")
@@ -390,34 +651,19 @@ with tab3:
     st.write('If we execute and plot the results of the previous statement, we can plot the daily number of IBC transactions in and out of Osmosis from the past 30 days.')
    
     
-    sql1 = """
-       select date_trunc('day', block_timestamp) as date,
-    action,
-    sum(amount/pow(10, decimal)) as total_amount from osmosis.core.fact_staking a 
-    where tx_succeeded = 'TRUE'
-    and  date_trunc('day', block_timestamp) >= current_date - 30
-    and currency = 'uosmo'
-    group by date, action   
-    """
-    
-    st.experimental_memo(ttl=1000000)
-    @st.experimental_memo
-    def compute(a):
-        results=sdk.query(a)
-        return results
-    
-    results1 = compute(sql1)
-    df1 = pd.DataFrame(results1.records)
-    
-    fig1 = px.bar(df1, x="date", y="total_amount", color="action", color_discrete_sequence=px.colors.qualitative.Pastel2)
-    fig1.update_layout(
-    title='Daily OSMO delegated, undelegated and redelegated - last 30 days',
-    xaxis_tickfont_size=14,
-    yaxis_tickfont_size=14,
-    bargap=0.15, # gap between bars of adjacent location coordinates.
-    bargroupgap=0.1 # gap between bars of the same location coordinate.
-    )
-    st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
+    
+    df1 = read_rollup("daily_staking_by_action", since=last_30_days)
+    
+    if rollup_ready(df1):
+        fig1 = cached_figure("bar", df1, x="date", y="total_amount", color="action", color_discrete_sequence=px.colors.qualitative.Pastel2,
+        layout=dict(
+        title='Daily OSMO delegated, undelegated and redelegated - last 30 days',
+        xaxis_tickfont_size=14,
+        yaxis_tickfont_size=14,
+        bargap=0.15, # gap between bars of adjacent location coordinates.
+        bargroupgap=0.1 # gap between bars of the same location coordinate.
+        ))
+        st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
  
     
 with tab4:    
@@ -797,220 +1043,28 @@ order by dt asc
     ''' 
     st.code(code13, language="sql", line_numbers=False)            
     
-    sql10 = """
-       with txs as (
-select
-distinct a.tx_id,
-a.msg_group,
-action
-from (
-select
-tx_id,
-msg_group,
-attribute_value as action
-from osmosis.core.fact_msg_attributes
-where attribute_key = 'action' and 
-(attribute_value = 'borrow' or attribute_value = 'deposit' or attribute_value = 'withdraw' or attribute_value = 'repay'
-)) a
-left join osmosis.core.fact_msg_attributes b
-on a.tx_id = b.tx_id
-where b.attribute_key = '_contract_address' and b.attribute_value = 'osmo1c3ljch9dfw5kf52nfwpxd2zmj2ese7agnx0p9tenkrryasrle5sqf3ftpg'
-),
-
-asset_flows as (
-
-select distinct *
-
-from (
-
-select
-date_trunc('hour',a.block_timestamp) as dt,
-a.tx_id,
-b.action,
-d.token as asset,
-a.amount/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount,
-a.amount*e.price/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount_usd
-from (
-select
-block_timestamp,
-tx_id,
-msg_group,
-attribute_value as amount
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm' and attribute_key = 'amount_scaled'
-) a
-join txs b
-on a.tx_id = b.tx_id and a.msg_group = b.msg_group
-join (
-select
-tx_id,
-msg_group,
-attribute_value as denom
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm-interests_updated' and attribute_key = 'denom'
-) c
-on a.tx_id = c.tx_id and a.msg_group = c.msg_group
-join (
-select
-address,
-upper(project_name) as token,
-decimal
-from osmosis.core.dim_tokens
-) d 
-on c.denom = d.address
-join (
-select 
-recorded_hour,
-symbol,
-price
-from osmosis.core.ez_prices
-) e 
-on d.token = e.symbol and date_trunc('hour',a.block_timestamp) = e.recorded_hour
-join (
-select
-tx_id,
-msg_group,
-attribute_value as liquidity_index
-from osmosis.core.fact_msg_attributes
-where msg_type = 'wasm-interests_updated' and attribute_key = 'liquidity_index'
-) f
-on a.tx_id = f.tx_id and a.msg_group = f.msg_group
-where e.recorded_hour is not null
-)
-),
-
-summarized_flows as (
-
-select 
-  dt,
-  sum(coalesce(case when action = 'deposit' and asset = 'OSMO' then amount end,0)) as Deposited_OSMO,
-  sum(coalesce(case when action = 'deposit' and asset = 'ATOM' then amount end,0)) as Deposited_ATOM,
-  sum(coalesce(case when action = 'deposit' and asset = 'USDC' then amount end,0)) as Deposited_USDC,
-  sum(coalesce(case when action = 'deposit' and asset = 'STATOM' then amount end,0)) as Deposited_stATOM,
-  sum(coalesce(case when action = 'borrow' and asset = 'OSMO' then amount end,0)) as Borrowed_OSMO,
-  sum(coalesce(case when action = 'borrow' and asset = 'ATOM' then amount end,0)) as Borrowed_ATOM,
-  sum(coalesce(case when action = 'borrow' and asset = 'USDC' then amount end,0)) as Borrowed_USDC,
-  sum(coalesce(case when action = 'borrow' and asset = 'STATOM' then amount end,0)) as Borrowed_stATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'OSMO' then amount end,0)) as Withdrawn_OSMO,
-  sum(coalesce(case when action = 'withdraw' and asset = 'ATOM' then amount end,0)) as Withdrawn_ATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'STATOM' then amount end,0)) as Withdrawn_stATOM,
-  sum(coalesce(case when action = 'withdraw' and asset = 'USDC' then amount end,0)) as Withdrawn_USDC,
-  sum(coalesce(case when action = 'repay' and asset = 'OSMO' then amount end,0)) as Repaid_OSMO,
-  sum(coalesce(case when action = 'repay' and asset = 'ATOM' then amount end,0)) as Repaid_ATOM,
-  sum(coalesce(case when action = 'repay' and asset = 'USDC' then amount end,0)) as Repaid_USDC,
-  sum(coalesce(case when action = 'repay' and asset = 'STATOM' then amount end,0)) as Repaid_stATOM,
-  SUM(Deposited_OSMO) over (order by dt asc) as Cum_Deposit_OSMO,
-  SUM(Borrowed_OSMO) over (order by dt asc) as Cum_Borrowed_OSMO,
-  SUM(Withdrawn_OSMO) over (order by dt asc) as Cum_Withdrawn_OSMO,
-  SUM(Repaid_OSMO) over (order by dt asc) as Cum_Repaid_OSMO,
-  SUM(Deposited_ATOM) over (order by dt asc) as Cum_Deposit_ATOM,
-  SUM(Borrowed_ATOM) over (order by dt asc) as Cum_Borrowed_ATOM,
-  SUM(Withdrawn_ATOM) over (order by dt asc) as Cum_Withdrawn_ATOM,
-  SUM(Repaid_ATOM) over (order by dt asc) as Cum_Repaid_ATOM,
-  SUM(Deposited_USDC) over (order by dt asc) as Cum_Deposit_USDC,
-  SUM(Borrowed_USDC) over (order by dt asc) as Cum_Borrowed_USDC,
-  SUM(Withdrawn_USDC) over (order by dt asc) as Cum_Withdrawn_USDC,
-  SUM(Repaid_USDC) over (order by dt asc) as Cum_Repaid_USDC,
-  SUM(Deposited_stATOM) over (order by dt asc) as Cum_Deposit_stATOM,
-  SUM(Borrowed_stATOM) over (order by dt asc) as Cum_Borrowed_stATOM,
-  SUM(Withdrawn_stATOM) over (order by dt asc) as Cum_Withdrawn_stATOM,
-  SUM(Repaid_stATOM) over (order by dt asc) as Cum_Repaid_stATOM
-from asset_flows
-group by 1
-order by 1 asc
-
-)
-
-select 
-a.*,
-coalesce((cum_deposit_OSMO-cum_withdrawn_OSMO)*OSMO_price,0) as OSMO_Deposit_TVL,
-coalesce((cum_deposit_ATOM-cum_withdrawn_ATOM)*ATOM_price,0) as ATOM_Deposit_TVL,
-coalesce((cum_deposit_stATOM-cum_withdrawn_stATOM)*stATOM_price,0) as stATOM_Deposit_TVL,
-coalesce((cum_deposit_USDC-cum_withdrawn_USDC)*USDC_price,0) as USDC_Deposit_TVL,
-coalesce((cum_borrowed_OSMO-cum_repaid_OSMO)*OSMO_price,0) as OSMO_Borrowed_TVL,
-coalesce((cum_borrowed_ATOM-cum_repaid_ATOM)*ATOM_price,0) as ATOM_Borrowed_TVL,
-coalesce((cum_borrowed_USDC-cum_repaid_USDC)*USDC_price,0) as USDC_Borrowed_TVL,
-coalesce((cum_borrowed_stATOM-cum_repaid_stATOM)*stATOM_price,0) as stATOM_Borrowed_TVL,
-OSMO_Deposit_TVL+ATOM_Deposit_TVL+USDC_Deposit_TVL+stATOM_Deposit_TVL as Deposit_TVL,
-OSMO_Borrowed_TVL+ATOM_Borrowed_TVL+USDC_Borrowed_TVL+stATOM_Borrowed_TVL as Borrow_TVL,
-Deposit_TVL - Borrow_TVL as Total_TVL,
-OSMO_Deposit_TVL-OSMO_Borrowed_TVL as OSMO_TVL,
-ATOM_Deposit_TVL-ATOM_Borrowed_TVL as ATOM_TVL,
-USDC_Deposit_TVL-USDC_Borrowed_TVL as USDC_TVL,
-stATOM_Deposit_TVL-stATOM_Borrowed_TVL as stATOM_TVL,
-case when OSMO_Deposit_TVL=0 then 0 else OSMO_Borrowed_TVL/OSMO_Deposit_TVL end as OSMO_Cap_Utilization,
-case when ATOM_Deposit_TVL=0 then 0 else ATOM_Borrowed_TVL/ATOM_Deposit_TVL end as ATOM_Cap_Utilization,
-case when USDC_Deposit_TVL=0 then 0 else USDC_Borrowed_TVL/USDC_Deposit_TVL end as USDC_Cap_Utilization,
-case when stATOM_Deposit_TVL=0 then 0 else stATOM_Borrowed_TVL/stATOM_Deposit_TVL end as stATOM_Cap_Utilization,
-Borrow_TVL/Deposit_TVL as Capital_Utilization,
-case when (((OSMO_Deposit_TVL*.61)+(ATOM_Deposit_TVL*.7)+(USDC_Deposit_TVL*.75)+(stATOM_Deposit_TVL*.55))/borrow_tvl) > 10 then 10
-else (((OSMO_Deposit_TVL*.61)+(ATOM_Deposit_TVL*.7)+(USDC_Deposit_TVL*.75)+(stATOM_Deposit_TVL*.55))/borrow_tvl) end as system_health_factor
-from summarized_flows a
-left join (
-select 
-recorded_hour as dt,
-price as OSMO_Price
-from osmosis.core.ez_prices
-where symbol = 'OSMO'
-) b
-on a.dt = b.dt
-left join (
-select 
-recorded_hour as dt,
-price as ATOM_Price
-from osmosis.core.ez_prices
-where symbol = 'ATOM'
-) c
-on a.dt = c.dt
-left join (
-select 
-recorded_hour as dt,
-price as USDC_Price
-from osmosis.core.ez_prices
-where symbol = 'USDC'
-) d
-on a.dt = d.dt
-left join (
-select 
-recorded_hour as dt,
-price as stATOM_Price
-from osmosis.core.ez_prices
-where symbol = 'STATOM'
-) e
-on a.dt = e.dt
-order by dt asc
-
-   
-    """
-    
-    st.experimental_memo(ttl=1000000)
-    @st.experimental_memo
-    def compute(a):
-        results=sdk.query(a)
-        return results
     
-    results10 = compute(sql10)
-    df10 = pd.DataFrame(results10.records)
-    df10 = df10.sort_values(by ='dt', ascending = True)
+    df10 = read_rollup("hourly_mars_flows_tvl")
     st.write('Using the query above, one can plot the charts below:')
     
-    fig1 = px.area(df10, x="dt", y="deposit_tvl", color_discrete_sequence=px.colors.qualitative.Pastel2)
-    fig1.update_layout(
-    title='Daily Mars deposit TVL (USD)',
-    xaxis_tickfont_size=14,
-    yaxis_tickfont_size=14,
-    bargap=0.15, # gap between bars of adjacent location coordinates.
-    bargroupgap=0.1 # gap between bars of the same location coordinate.
-    )
-    st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
+    if rollup_ready(df10):
+        fig1 = cached_figure("area", df10, x="dt", y="deposit_tvl", color_discrete_sequence=px.colors.qualitative.Pastel2,
+        layout=dict(
+        title='Daily Mars deposit TVL (USD)',
+        xaxis_tickfont_size=14,
+        yaxis_tickfont_size=14,
+        bargap=0.15, # gap between bars of adjacent location coordinates.
+        bargroupgap=0.1 # gap between bars of the same location coordinate.
+        ))
+        st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
 
-    fig1 = px.area(df10, x="dt", y="borrow_tvl", color_discrete_sequence=px.colors.qualitative.Pastel2)
-    fig1.update_layout(
-    title='Daily Mars borrow TVL (USD)',
-    xaxis_tickfont_size=14,
-    yaxis_tickfont_size=14
-    )
-    st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
+        fig1 = cached_figure("area", df10, x="dt", y="borrow_tvl", color_discrete_sequence=px.colors.qualitative.Pastel2,
+        layout=dict(
+        title='Daily Mars borrow TVL (USD)',
+        xaxis_tickfont_size=14,
+        yaxis_tickfont_size=14
+        ))
+        st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
  
 with tab5:
      
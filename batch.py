@@ -0,0 +1,154 @@
+# Run SQL statements outside the app, for scheduled jobs. Each statement is
+# executed through the same provider router, retries and result cache as the
+# editor, at most --concurrency at a time, and written to Parquet:
+#
+#   python batch.py queries/ --out results/ --concurrency 4
+#
+# A file may hold several statements separated by semicolons. A manifest
+# with per-statement timings is written to <out>/manifest.json. Streamlit is
+# never imported, so this starts quickly in cron and batch containers.
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+from providers import build_router, query_key
+from scheduler import QueryScheduler
+from sql_rewrite import mask
+from warmup import SECRETS_PATH, load_secrets
+
+BATCH_CONCURRENCY = int(os.environ.get("QUERY_OSMOSIS_BATCH_CONCURRENCY", 4))
+MANIFEST_NAME = "manifest.json"
+
+
+# Statements of a SQL script, split on semicolons outside strings and comments
+def split_statements(sql):
+    statements, start = [], 0
+    masked = mask(sql)
+    for m in re.finditer(";", masked):
+        statements.append(sql[start : m.start()])
+        start = m.end()
+    statements.append(sql[start:])
+    return [s.strip() for s in statements if mask(s).strip()]
+
+
+# (name, source, sql) for a .sql file or every .sql file in a directory.
+# Statements are named after their file, with a suffix when a file has more
+# than one.
+def collect_statements(path):
+    files = sorted(glob.glob(os.path.join(path, "*.sql"))) if os.path.isdir(path) else [path]
+    collected = []
+    for file in files:
+        with open(file) as f:
+            statements = split_statements(f.read())
+        stem = re.sub(r"[^\w.-]", "_", os.path.splitext(os.path.basename(file))[0])
+        for number, sql in enumerate(statements, start=1):
+            name = stem if len(statements) == 1 else f"{stem}_{number}"
+            collected.append((name, file, sql))
+    return collected
+
+
+# Execute one statement and write its result to `out_dir`/<name>.parquet.
+# Returns its manifest entry; failures are recorded rather than raised.
+def run_statement(router, scheduler, name, source, sql, out_dir, use_cache=True):
+    entry = {"name": name, "source": source, "query_key": query_key(sql), "output": None}
+    started = time.monotonic()
+    fetch = None
+    try:
+        fetch = scheduler.run(lambda: router.execute(sql, use_cache=use_cache), session_id="batch")
+        entry["provider"] = getattr(fetch, "provider", None)
+        if fetch.error is not None:
+            entry["status"] = "failed"
+            if fetch.missing_pages is None:
+                entry["error"] = str(fetch.error.cause)
+            else:
+                entry["error"] = f"pages {fetch.missing_pages} of {fetch.total_pages} could not be retrieved: {fetch.error.cause}"
+        else:
+            path = os.path.join(out_dir, f"{name}.parquet")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            fetch.result.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+            entry.update(status="ok", output=path, rows=fetch.result.num_rows, columns=list(fetch.result.columns))
+            if fetch.truncated_pages:
+                entry["truncated_pages"] = fetch.truncated_pages
+    except Exception as e:
+        entry.update(status="failed", error=str(e))
+    finally:
+        if fetch is not None and fetch.result is not None:
+            fetch.result.release()
+    entry["duration_s"] = round(time.monotonic() - started, 3)
+    return entry
+
+
+def run_batch(router, scheduler, statements, out_dir, concurrency=BATCH_CONCURRENCY, use_cache=True, progress=None):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {"started_at": time.time(), "concurrency": concurrency, "queries": []}
+    started = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(run_statement, router, scheduler, name, source, sql, out_dir, use_cache)
+            for name, source, sql in statements
+        ]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            entry = future.result()
+            manifest["queries"].append(entry)
+            if progress is not None:
+                progress(done, len(futures), entry)
+    order = {name: i for i, (name, _, _) in enumerate(statements)}
+    manifest["queries"].sort(key=lambda entry: order[entry["name"]])
+    manifest["finished_at"] = time.time()
+    manifest["duration_s"] = round(time.monotonic() - started, 3)
+    manifest["failed"] = sum(1 for entry in manifest["queries"] if entry["status"] != "ok")
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run SQL statements against Flipside and write the results to Parquet.")
+    parser.add_argument("path", help="a .sql file or a directory of .sql files")
+    parser.add_argument("--out", default="results", help="directory for the Parquet files and the manifest")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="statements run at once")
+    parser.add_argument("--no-cache", action="store_true", help="always run remotely, ignoring the result cache")
+    args = parser.parse_args(argv)
+
+    statements = collect_statements(args.path)
+    if not statements:
+        parser.error(f"no SQL statements found in {args.path}")
+    names = [name for name, _, _ in statements]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        parser.error(f"statement names are not unique: {', '.join(duplicates)}")
+    secrets = load_secrets()
+    if "API_KEY" not in secrets:
+        parser.error(f"no API key: set FLIPSIDE_API_KEY or API_KEY in {SECRETS_PATH}")
+
+    scheduler = QueryScheduler(max_concurrent=args.concurrency)
+    router = build_router(
+        secrets["API_KEY"],
+        secondary_api_key=secrets.get("API_KEY_SECONDARY"),
+        secondary_base_url=secrets.get("API_BASE_URL_SECONDARY"),
+        before_page=scheduler.page_permit,
+        max_concurrent=args.concurrency,
+    )
+
+    def progress(done, total, entry):
+        detail = f"{entry.get('rows')} rows" if entry["status"] == "ok" else entry["error"]
+        print(f"[{done}/{total}] {entry['name']}: {entry['status']} in {entry['duration_s']}s ({detail})", flush=True)
+
+    manifest = run_batch(
+        router, scheduler, statements, args.out, args.concurrency, use_cache=not args.no_cache, progress=progress
+    )
+    print(
+        f"Batch finished in {manifest['duration_s']}s, {manifest['failed']} of {len(statements)} statements failed. "
+        f"Manifest: {os.path.join(args.out, MANIFEST_NAME)}"
+    )
+    return 1 if manifest["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import requests
+
+from flipside_fetch import NON_RETRYABLE_ERRORS, FetchState, PageFetchError, fetch_pages, with_retries
+from result_store import store_table
+
+# Base URL of a service that serves finished query runs in bulk, as
+# {base_url}/{query_id}.{format}. Unset means the JSON page path is used.
+BULK_RESULTS_URL = os.environ.get("QUERY_OSMOSIS_BULK_RESULTS_URL")
+BULK_FORMAT = os.environ.get("QUERY_OSMOSIS_BULK_FORMAT", "arrow")
+BULK_TIMEOUT = float(os.environ.get("QUERY_OSMOSIS_BULK_TIMEOUT", 300))
+BULK_FORMATS = ("arrow", "parquet", "csv.gz")
+CHUNK_SIZE = 1 << 20
+
+
+# `status_code` is the HTTP status of a failed download, if there was one.
+# Only server errors and rate limiting are worth retrying; a missing file or
+# an unsupported format will not change.
+class BulkFetchError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        return self.status_code is not None and (self.status_code >= 500 or self.status_code == 429)
+
+
+# Decode a downloaded result file into an Arrow table. Arrow IPC is
+# memory-mapped without copying; Parquet and CSV use pyarrow's vectorized,
+# multi-threaded readers and produce typed columns directly.
+def read_table(path, fmt):
+    if fmt == "arrow":
+        source = pa.memory_map(path, "r")
+        try:
+            return pa.ipc.open_file(source).read_all()
+        except pa.ArrowInvalid:
+            source.seek(0)
+            return pa.ipc.open_stream(source).read_all()
+    if fmt == "parquet":
+        return pq.read_table(path, memory_map=True)
+    if fmt == "csv.gz":
+        return pa_csv.read_csv(path)
+    raise BulkFetchError(f"unsupported bulk format {fmt!r}, expected one of {BULK_FORMATS}")
+
+
+def _normalize(table):
+    table = table.rename_columns([name.lower() for name in table.column_names])
+    if "__row_index" in table.column_names:
+        table = table.drop(["__row_index"])
+    return table
+
+
+# Stream {base_url}/{query_id}.{fmt} to a temporary file and decode it into a
+# StoredResult, which spills to disk itself when the table is over budget
+def download_result(base_url, query_id, fmt, api_key=None, session=requests, timeout=BULK_TIMEOUT):
+    if fmt not in BULK_FORMATS:
+        raise BulkFetchError(f"unsupported bulk format {fmt!r}, expected one of {BULK_FORMATS}")
+    url = f"{base_url.rstrip('/')}/{query_id}.{fmt}"
+    headers = {"x-api-key": api_key} if api_key else {}
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise BulkFetchError(f"{url} returned HTTP {response.status_code}", response.status_code)
+        # Undo transfer compression only; a csv.gz body stays compressed and
+        # is decompressed by pyarrow while parsing
+        response.raw.decode_content = True
+        with tempfile.NamedTemporaryFile(suffix=f".{fmt}") as f:
+            shutil.copyfileobj(response.raw, f, CHUNK_SIZE)
+            f.flush()
+            return store_table(_normalize(read_table(f.name, fmt)))
+
+
+# Run `q` and download its result in bulk. The query is executed through the
+# SDK with a one-row page to learn the run id; if the bulk download fails
+# the rows are read from the same run through the JSON page path instead.
+def fetch_bulk(sdk, q, base_url, fmt=BULK_FORMAT, api_key=None, before_page=None):
+    state = FetchState(q)
+
+    def run():
+        if before_page is not None:
+            before_page()
+        return sdk.query(q, page_size=1, page_number=1)
+
+    try:
+        data = with_retries(run)
+    except NON_RETRYABLE_ERRORS:
+        raise
+    except Exception as e:
+        state.error = PageFetchError(1, e)
+        state.result = store_table(pa.table({}))
+        return state
+    state.query_id = data.query_id
+
+    # Definitive failures are returned rather than raised, so they fall back
+    # to the JSON pages at once instead of being retried
+    def download():
+        try:
+            return download_result(base_url, state.query_id, fmt, api_key=api_key), None
+        except BulkFetchError as e:
+            if e.retryable:
+                raise
+            return None, e
+
+    try:
+        if before_page is not None:
+            before_page()
+        result, error = with_retries(download)
+    except NON_RETRYABLE_ERRORS:
+        raise
+    except Exception as e:
+        result, error = None, e
+    if error is not None:
+        return fetch_pages(sdk, q, state=state, before_page=before_page)
+    state.total_pages = 1
+    state.next_page = 2
+    state.result = result
+    return state
@@ -0,0 +1,210 @@
+# SQL behind the tab3/tab4 dashboard charts. These are materialized into
+# local rollup tables (see rollups.py) instead of being run per page load.
+
+DAILY_TRANSFERS_SQL = """
+       select date_trunc('day', block_timestamp) as date,
+    transfer_type,
+    count(distinct tx_id) as num_tx from osmosis.core.fact_transfers a 
+    where tx_succeeded = 'TRUE'
+    and  date_trunc('day', block_timestamp) >= current_date - 30
+    and transfer_type in ('IBC_TRANSFER_IN','IBC_TRANSFER_OUT')
+    group by date, transfer_type
+
+    
+    """
+
+DAILY_STAKING_SQL = """
+       select date_trunc('day', block_timestamp) as date,
+    action,
+    sum(amount/pow(10, decimal)) as total_amount from osmosis.core.fact_staking a 
+    where tx_succeeded = 'TRUE'
+    and  date_trunc('day', block_timestamp) >= current_date - 30
+    and currency = 'uosmo'
+    group by date, action   
+    """
+
+MARS_TVL_SQL = """
+       with txs as (
+select
+distinct a.tx_id,
+a.msg_group,
+action
+from (
+select
+tx_id,
+msg_group,
+attribute_value as action
+from osmosis.core.fact_msg_attributes
+where attribute_key = 'action' and 
+(attribute_value = 'borrow' or attribute_value = 'deposit' or attribute_value = 'withdraw' or attribute_value = 'repay'
+)) a
+left join osmosis.core.fact_msg_attributes b
+on a.tx_id = b.tx_id
+where b.attribute_key = '_contract_address' and b.attribute_value = 'osmo1c3ljch9dfw5kf52nfwpxd2zmj2ese7agnx0p9tenkrryasrle5sqf3ftpg'
+),
+
+asset_flows as (
+
+select distinct *
+
+from (
+
+select
+date_trunc('hour',a.block_timestamp) as dt,
+a.tx_id,
+b.action,
+d.token as asset,
+a.amount/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount,
+a.amount*e.price/pow(10,d.decimal)/pow(10,6)/f.liquidity_index as amount_usd
+from (
+select
+block_timestamp,
+tx_id,
+msg_group,
+attribute_value as amount
+from osmosis.core.fact_msg_attributes
+where msg_type = 'wasm' and attribute_key = 'amount_scaled'
+) a
+join txs b
+on a.tx_id = b.tx_id and a.msg_group = b.msg_group
+join (
+select
+tx_id,
+msg_group,
+attribute_value as denom
+from osmosis.core.fact_msg_attributes
+where msg_type = 'wasm-interests_updated' and attribute_key = 'denom'
+) c
+on a.tx_id = c.tx_id and a.msg_group = c.msg_group
+join (
+select
+address,
+upper(project_name) as token,
+decimal
+from osmosis.core.dim_tokens
+) d 
+on c.denom = d.address
+join (
+select 
+recorded_hour,
+symbol,
+price
+from osmosis.core.ez_prices
+) e 
+on d.token = e.symbol and date_trunc('hour',a.block_timestamp) = e.recorded_hour
+join (
+select
+tx_id,
+msg_group,
+attribute_value as liquidity_index
+from osmosis.core.fact_msg_attributes
+where msg_type = 'wasm-interests_updated' and attribute_key = 'liquidity_index'
+) f
+on a.tx_id = f.tx_id and a.msg_group = f.msg_group
+where e.recorded_hour is not null
+)
+),
+
+summarized_flows as (
+
+select 
+  dt,
+  sum(coalesce(case when action = 'deposit' and asset = 'OSMO' then amount end,0)) as Deposited_OSMO,
+  sum(coalesce(case when action = 'deposit' and asset = 'ATOM' then amount end,0)) as Deposited_ATOM,
+  sum(coalesce(case when action = 'deposit' and asset = 'USDC' then amount end,0)) as Deposited_USDC,
+  sum(coalesce(case when action = 'deposit' and asset = 'STATOM' then amount end,0)) as Deposited_stATOM,
+  sum(coalesce(case when action = 'borrow' and asset = 'OSMO' then amount end,0)) as Borrowed_OSMO,
+  sum(coalesce(case when action = 'borrow' and asset = 'ATOM' then amount end,0)) as Borrowed_ATOM,
+  sum(coalesce(case when action = 'borrow' and asset = 'USDC' then amount end,0)) as Borrowed_USDC,
+  sum(coalesce(case when action = 'borrow' and asset = 'STATOM' then amount end,0)) as Borrowed_stATOM,
+  sum(coalesce(case when action = 'withdraw' and asset = 'OSMO' then amount end,0)) as Withdrawn_OSMO,
+  sum(coalesce(case when action = 'withdraw' and asset = 'ATOM' then amount end,0)) as Withdrawn_ATOM,
+  sum(coalesce(case when action = 'withdraw' and asset = 'STATOM' then amount end,0)) as Withdrawn_stATOM,
+  sum(coalesce(case when action = 'withdraw' and asset = 'USDC' then amount end,0)) as Withdrawn_USDC,
+  sum(coalesce(case when action = 'repay' and asset = 'OSMO' then amount end,0)) as Repaid_OSMO,
+  sum(coalesce(case when action = 'repay' and asset = 'ATOM' then amount end,0)) as Repaid_ATOM,
+  sum(coalesce(case when action = 'repay' and asset = 'USDC' then amount end,0)) as Repaid_USDC,
+  sum(coalesce(case when action = 'repay' and asset = 'STATOM' then amount end,0)) as Repaid_stATOM,
+  SUM(Deposited_OSMO) over (order by dt asc) as Cum_Deposit_OSMO,
+  SUM(Borrowed_OSMO) over (order by dt asc) as Cum_Borrowed_OSMO,
+  SUM(Withdrawn_OSMO) over (order by dt asc) as Cum_Withdrawn_OSMO,
+  SUM(Repaid_OSMO) over (order by dt asc) as Cum_Repaid_OSMO,
+  SUM(Deposited_ATOM) over (order by dt asc) as Cum_Deposit_ATOM,
+  SUM(Borrowed_ATOM) over (order by dt asc) as Cum_Borrowed_ATOM,
+  SUM(Withdrawn_ATOM) over (order by dt asc) as Cum_Withdrawn_ATOM,
+  SUM(Repaid_ATOM) over (order by dt asc) as Cum_Repaid_ATOM,
+  SUM(Deposited_USDC) over (order by dt asc) as Cum_Deposit_USDC,
+  SUM(Borrowed_USDC) over (order by dt asc) as Cum_Borrowed_USDC,
+  SUM(Withdrawn_USDC) over (order by dt asc) as Cum_Withdrawn_USDC,
+  SUM(Repaid_USDC) over (order by dt asc) as Cum_Repaid_USDC,
+  SUM(Deposited_stATOM) over (order by dt asc) as Cum_Deposit_stATOM,
+  SUM(Borrowed_stATOM) over (order by dt asc) as Cum_Borrowed_stATOM,
+  SUM(Withdrawn_stATOM) over (order by dt asc) as Cum_Withdrawn_stATOM,
+  SUM(Repaid_stATOM) over (order by dt asc) as Cum_Repaid_stATOM
+from asset_flows
+group by 1
+order by 1 asc
+
+)
+
+select 
+a.*,
+coalesce((cum_deposit_OSMO-cum_withdrawn_OSMO)*OSMO_price,0) as OSMO_Deposit_TVL,
+coalesce((cum_deposit_ATOM-cum_withdrawn_ATOM)*ATOM_price,0) as ATOM_Deposit_TVL,
+coalesce((cum_deposit_stATOM-cum_withdrawn_stATOM)*stATOM_price,0) as stATOM_Deposit_TVL,
+coalesce((cum_deposit_USDC-cum_withdrawn_USDC)*USDC_price,0) as USDC_Deposit_TVL,
+coalesce((cum_borrowed_OSMO-cum_repaid_OSMO)*OSMO_price,0) as OSMO_Borrowed_TVL,
+coalesce((cum_borrowed_ATOM-cum_repaid_ATOM)*ATOM_price,0) as ATOM_Borrowed_TVL,
+coalesce((cum_borrowed_USDC-cum_repaid_USDC)*USDC_price,0) as USDC_Borrowed_TVL,
+coalesce((cum_borrowed_stATOM-cum_repaid_stATOM)*stATOM_price,0) as stATOM_Borrowed_TVL,
+OSMO_Deposit_TVL+ATOM_Deposit_TVL+USDC_Deposit_TVL+stATOM_Deposit_TVL as Deposit_TVL,
+OSMO_Borrowed_TVL+ATOM_Borrowed_TVL+USDC_Borrowed_TVL+stATOM_Borrowed_TVL as Borrow_TVL,
+Deposit_TVL - Borrow_TVL as Total_TVL,
+OSMO_Deposit_TVL-OSMO_Borrowed_TVL as OSMO_TVL,
+ATOM_Deposit_TVL-ATOM_Borrowed_TVL as ATOM_TVL,
+USDC_Deposit_TVL-USDC_Borrowed_TVL as USDC_TVL,
+stATOM_Deposit_TVL-stATOM_Borrowed_TVL as stATOM_TVL,
+case when OSMO_Deposit_TVL=0 then 0 else OSMO_Borrowed_TVL/OSMO_Deposit_TVL end as OSMO_Cap_Utilization,
+case when ATOM_Deposit_TVL=0 then 0 else ATOM_Borrowed_TVL/ATOM_Deposit_TVL end as ATOM_Cap_Utilization,
+case when USDC_Deposit_TVL=0 then 0 else USDC_Borrowed_TVL/USDC_Deposit_TVL end as USDC_Cap_Utilization,
+case when stATOM_Deposit_TVL=0 then 0 else stATOM_Borrowed_TVL/stATOM_Deposit_TVL end as stATOM_Cap_Utilization,
+Borrow_TVL/Deposit_TVL as Capital_Utilization,
+case when (((OSMO_Deposit_TVL*.61)+(ATOM_Deposit_TVL*.7)+(USDC_Deposit_TVL*.75)+(stATOM_Deposit_TVL*.55))/borrow_tvl) > 10 then 10
+else (((OSMO_Deposit_TVL*.61)+(ATOM_Deposit_TVL*.7)+(USDC_Deposit_TVL*.75)+(stATOM_Deposit_TVL*.55))/borrow_tvl) end as system_health_factor
+from summarized_flows a
+left join (
+select 
+recorded_hour as dt,
+price as OSMO_Price
+from osmosis.core.ez_prices
+where symbol = 'OSMO'
+) b
+on a.dt = b.dt
+left join (
+select 
+recorded_hour as dt,
+price as ATOM_Price
+from osmosis.core.ez_prices
+where symbol = 'ATOM'
+) c
+on a.dt = c.dt
+left join (
+select 
+recorded_hour as dt,
+price as USDC_Price
+from osmosis.core.ez_prices
+where symbol = 'USDC'
+) d
+on a.dt = d.dt
+left join (
+select 
+recorded_hour as dt,
+price as stATOM_Price
+from osmosis.core.ez_prices
+where symbol = 'STATOM'
+) e
+on a.dt = e.dt
+order by dt asc
+
+   
+    """
@@ -0,0 +1,74 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+
+# Serialized figure specs kept in the process, shared by every session
+FIGURE_CACHE_SIZE = int(os.environ.get("QUERY_OSMOSIS_FIGURE_CACHE_SIZE", 32))
+
+
+# Content hash of a frame: column names, dtypes and every value, so a frame
+# read again with the same rows hashes the same
+def frame_hash(df):
+    h = hashlib.sha256()
+    h.update(json.dumps([[str(c) for c in df.columns], [str(t) for t in df.dtypes]]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+# Plotly Express figures keyed by the data hash plus the chart parameters.
+# Building a figure from a large frame is much slower than loading its JSON
+# spec, so a figure is only rebuilt when its data or parameters change.
+class FigureCache:
+    def __init__(self, max_entries=FIGURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._specs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, kind, df, layout, params):
+        chart = json.dumps({"kind": kind, "layout": layout, "params": params}, sort_keys=True, default=str)
+        return f"{frame_hash(df)}:{hashlib.sha256(chart.encode()).hexdigest()}"
+
+    # px.<kind>(df, **params) with `layout` applied through update_layout
+    def figure(self, kind, df, layout=None, **params):
+        key = self._key(kind, df, layout, params)
+        with self._lock:
+            spec = self._specs.get(key)
+            if spec is not None:
+                self._specs.move_to_end(key)
+                self.hits += 1
+        if spec is None:
+            fig = getattr(px, kind)(df, **params)
+            if layout:
+                fig.update_layout(**layout)
+            spec = fig.to_json()
+            with self._lock:
+                self.misses += 1
+                self._specs[key] = spec
+                while len(self._specs) > self.max_entries:
+                    self._specs.popitem(last=False)
+            return fig
+        return pio.from_json(spec)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "entries": len(self._specs),
+                "mb": round(sum(len(spec) for spec in self._specs.values()) / 2**20, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+default_figure_cache = FigureCache()
+
+
+def cached_figure(kind, df, layout=None, **params):
+    return default_figure_cache.figure(kind, df, layout=layout, **params)
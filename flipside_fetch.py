@@ -0,0 +1,142 @@
+import os
+import random
+import time
+
+import pandas as pd
+from shroomdk.errors import QueryRunCancelledError, QueryRunExecutionError, QueryRunTimeoutError
+
+from result_store import ResultBuilder
+
+PAGE_SIZE = 100000
+MAX_PAGES = 10  # max is a million rows @ 100k per page
+RETRY_ATTEMPTS = int(os.environ.get("QUERY_OSMOSIS_PAGE_RETRIES", 4))
+RETRY_BASE_DELAY = float(os.environ.get("QUERY_OSMOSIS_RETRY_BASE_DELAY", 1.0))
+RETRY_MAX_DELAY = float(os.environ.get("QUERY_OSMOSIS_RETRY_MAX_DELAY", 30.0))
+
+# Raised from `before_page` to stop a fetch whose result is no longer
+# wanted, e.g. a hedged request that lost the race
+class FetchCancelled(Exception):
+    pass
+
+
+# Errors in the SQL itself, runs that hit the SDK's timeout (resubmitting
+# would hold a slot and spend quota for another full timeout each time),
+# and cancellation
+NON_RETRYABLE_ERRORS = (QueryRunExecutionError, QueryRunCancelledError, QueryRunTimeoutError, FetchCancelled)
+
+
+class PageFetchError(Exception):
+    def __init__(self, page_number, cause):
+        super().__init__(f"page {page_number} could not be retrieved: {cause}")
+        self.page_number = page_number
+        self.cause = cause
+
+
+# Call `fn` up to `attempts` times, sleeping with exponential backoff and
+# full jitter between attempts
+def with_retries(
+    fn,
+    attempts=RETRY_ATTEMPTS,
+    base_delay=RETRY_BASE_DELAY,
+    max_delay=RETRY_MAX_DELAY,
+    sleep=time.sleep,
+):
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except NON_RETRYABLE_ERRORS:
+            raise
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            sleep(random.uniform(0, min(max_delay, base_delay * 2**attempt)))
+
+
+# Progress of a paged fetch. `result` holds the rows of pages
+# 1..next_page-1; when a page fails after all retries the fetch stops there
+# and can be resumed from `next_page` without re-running the query.
+# `available_pages` is the page count the query run reported, which can be
+# more than the `total_pages` fetched.
+class FetchState:
+    def __init__(self, query):
+        self.query = query
+        self.query_id = None
+        self.total_pages = None
+        self.available_pages = None
+        self.next_page = 1
+        self.result = None
+        self.error = None
+        self.provider = None
+
+    # State for a result that was produced in one go, e.g. by merging shards
+    @classmethod
+    def finished(cls, query, result):
+        state = cls(query)
+        state.total_pages = 1
+        state.next_page = 2
+        state.result = result
+        return state
+
+    # Page numbers that have not been retrieved, or None if the page count
+    # is not known yet
+    @property
+    def missing_pages(self):
+        if self.total_pages is None:
+            return None
+        return list(range(self.next_page, self.total_pages + 1))
+
+    # Pages of the query run left out by the page limit
+    @property
+    def truncated_pages(self):
+        if self.total_pages is None or self.available_pages is None:
+            return []
+        return list(range(self.total_pages + 1, self.available_pages + 1))
+
+
+def _records_frame(data):
+    return pd.json_normalize(data.records).drop(columns=["__row_index"], errors="ignore")
+
+
+# Fetch (or resume fetching) all pages of `q`. Page 1 executes the query;
+# later pages are read from the same query run by id. `before_page` is
+# called before every page request, e.g. to apply a rate limit.
+def fetch_pages(sdk, q, state=None, before_page=None, page_size=PAGE_SIZE, max_pages=MAX_PAGES):
+    if state is None:
+        state = FetchState(q)
+    builder = ResultBuilder()
+    if state.result is not None:
+        builder.extend(state.result)
+        state.result.release()
+    state.error = None
+
+    while state.total_pages is None or state.next_page <= state.total_pages:
+        page_number = state.next_page
+
+        def request():
+            if before_page is not None:
+                before_page()
+            if state.query_id is None:
+                return sdk.query(q, page_size=page_size, page_number=page_number)
+            return sdk.get_query_results(
+                state.query_id, page_number=page_number, page_size=page_size
+            )
+
+        try:
+            data = with_retries(request)
+        except NON_RETRYABLE_ERRORS:
+            builder.finish().release()
+            raise
+        except Exception as e:
+            state.error = PageFetchError(page_number, e)
+            break
+        if state.query_id is None:
+            state.query_id = data.query_id
+        if state.total_pages is None:
+            state.available_pages = max(1, data.page.totalPages if data.page is not None else 1)
+            state.total_pages = min(state.available_pages, max_pages)
+        if data.records:
+            builder.append(_records_frame(data))
+        state.next_page += 1
+
+    state.result = builder.finish()
+    return state
@@ -0,0 +1,307 @@
+# Capacity test: simulate concurrent viewers of one app instance. The app is
+# served in a subprocess whose provider router is replaced by a stub with
+# log-normally distributed latency, and each simulated session talks to it
+# over the same websocket protocol as a browser:
+#
+#   python loadtest.py --sessions 20 --duration 60
+#
+# Sessions load the page, submit editor queries and trigger reruns, with
+# think time in between. Tabs are switched in the browser without a script
+# run, so they cost the server nothing and are not simulated. The report has
+# throughput, p50/p95/p99 render latency, provider calls per session and the
+# server's peak RSS.
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+LOADTEST_QUERIES = [
+    "select * from osmosis.core.fact_transfers limit 10",
+    "select distinct transfer_type from osmosis.core.fact_transfers",
+    "select block_timestamp, tx_id, amount from osmosis.core.fact_staking limit 100",
+    "select symbol, price from osmosis.core.ez_prices limit 100",
+]
+
+
+# Provider standing in for Flipside. Dashboard rollup queries get frames
+# shaped like the real ones, anything else `rows` generic rows.
+class StubProvider:
+    def __init__(self, latency=1.5, latency_sigma=0.5, rows=1000, name="Flipside"):
+        self.name = name
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.rows = rows
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _frame(self, q):
+        from rollups import ROLLUPS
+
+        today = pd.Timestamp.utcnow().tz_localize(None).normalize()
+        name = next((rollup.name for rollup in ROLLUPS if rollup.sql == q), None)
+        if name == "daily_transfers_by_type":
+            dates = pd.date_range(end=today, periods=30, freq="D").repeat(2)
+            return pd.DataFrame(
+                {"date": dates, "transfer_type": ["IBC_TRANSFER_IN", "IBC_TRANSFER_OUT"] * 30, "num_tx": np.random.randint(1000, 50000, 60)}
+            )
+        if name == "daily_staking_by_action":
+            dates = pd.date_range(end=today, periods=30, freq="D").repeat(3)
+            return pd.DataFrame(
+                {"date": dates, "action": ["delegate", "undelegate", "redelegate"] * 30, "total_amount": np.random.rand(90) * 1e6}
+            )
+        if name == "hourly_mars_flows_tvl":
+            dt = pd.date_range(end=today, periods=24 * 365, freq="H")
+            return pd.DataFrame(
+                {"dt": dt, "deposit_tvl": np.random.rand(len(dt)) * 1e7, "borrow_tvl": np.random.rand(len(dt)) * 1e6}
+            )
+        return pd.DataFrame(
+            {
+                "block_timestamp": pd.date_range(end=today, periods=self.rows, freq="min"),
+                "tx_id": [f"{i:064X}" for i in range(self.rows)],
+                "amount": np.random.rand(self.rows) * 1e6,
+            }
+        )
+
+    def execute(self, q, state=None, cancel=None):
+        from flipside_fetch import FetchState
+        from result_store import store_result
+
+        with self._lock:
+            self.calls += 1
+        time.sleep(random.lognormvariate(math.log(self.latency), self.latency_sigma))
+        return FetchState.finished(q, store_result(self._frame(q)))
+
+
+# Run the app with the stub provider. Provider calls and peak RSS are
+# written to `stats_path` every half second.
+def serve(port, stats_path, latency, latency_sigma, rows):
+    import providers
+    from session_memory import peak_rss_bytes
+
+    stub = StubProvider(latency, latency_sigma, rows)
+
+    def build_stub_router(*args, **kwargs):
+        return providers.ProviderRouter([stub], cache=providers.ResultCacheProvider())
+
+    providers.build_router = build_stub_router
+
+    def write_stats():
+        while True:
+            tmp_path = f"{stats_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"provider_calls": stub.calls, "peak_rss_bytes": peak_rss_bytes()}, f)
+            os.replace(tmp_path, stats_path)
+            time.sleep(0.5)
+
+    threading.Thread(target=write_stats, name="loadtest-stats", daemon=True).start()
+
+    from streamlit.web import bootstrap
+
+    flag_options = {
+        "server_port": port,
+        "server_headless": True,
+        "server_fileWatcherType": "none",
+        "browser_gatherUsageStats": False,
+        "global_developmentMode": False,
+    }
+    bootstrap.load_config_options(flag_options=flag_options)
+    bootstrap.run("app.py", "", [], flag_options)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))], 3)
+
+
+# One simulated viewer. Every script run is recorded as (kind, seconds from
+# the rerun request to the script finishing).
+async def simulate_session(url, deadline, think_time, query_probability, runs):
+    import tornado.websocket
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+    ws = await tornado.websocket.websocket_connect(url, max_message_size=1 << 30)
+    editor_id = None
+
+    async def rerun(kind, widgets):
+        nonlocal editor_id
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.widget_states.widgets.extend(widgets)
+        started = time.monotonic()
+        await ws.write_message(msg.SerializeToString(), binary=True)
+        while True:
+            data = await ws.read_message()
+            if data is None:
+                raise ConnectionError("server closed the connection")
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            kind_of_msg = forward.WhichOneof("type")
+            if kind_of_msg == "delta" and editor_id is None:
+                element = forward.delta.new_element
+                if element.WhichOneof("type") == "component_instance" and "ace" in element.component_instance.component_name:
+                    editor_id = element.component_instance.id
+            elif kind_of_msg == "script_finished":
+                if forward.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                runs.append((kind, time.monotonic() - started))
+                return
+
+    try:
+        widgets = []
+        await rerun("load", widgets)
+        while time.monotonic() < deadline:
+            await asyncio.sleep(random.uniform(0, 2 * think_time))
+            if editor_id is not None and random.random() < query_probability:
+                editor = WidgetState(id=editor_id, json_value=json.dumps(random.choice(LOADTEST_QUERIES)))
+                widgets = [editor]
+                await rerun("query", widgets)
+            else:
+                await rerun("rerun", widgets)
+    finally:
+        ws.close()
+
+
+async def run_sessions(url, sessions, duration, think_time, query_probability, ramp_up):
+    runs = []
+    deadline = time.monotonic() + duration
+
+    async def start(index):
+        await asyncio.sleep(ramp_up * index / max(1, sessions))
+        await simulate_session(url, deadline, think_time, query_probability, runs)
+
+    started = time.monotonic()
+    outcomes = await asyncio.gather(*(start(i) for i in range(sessions)), return_exceptions=True)
+    errors = [str(outcome) for outcome in outcomes if isinstance(outcome, Exception)]
+    return runs, errors, time.monotonic() - started
+
+
+def _wait_until_healthy(port, server, timeout=120):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if server.poll() is not None:
+            raise RuntimeError(f"the app exited with status {server.returncode} before it was ready")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"the app was not ready after {timeout}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test one app instance with simulated concurrent sessions.")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated sessions")
+    parser.add_argument("--duration", type=float, default=60, help="seconds each session keeps interacting")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which sessions are started")
+    parser.add_argument("--think-time", type=float, default=2, help="mean seconds between a session's actions")
+    parser.add_argument("--query-probability", type=float, default=0.3, help="share of actions that submit an editor query")
+    parser.add_argument("--latency", type=float, default=1.5, help="median stub provider latency in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal sigma of the stub latency")
+    parser.add_argument("--rows", type=int, default=1000, help="rows returned for editor queries")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--report", help="also write the report as JSON to this path")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--stats", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.port, args.stats, args.latency, args.latency_sigma, args.rows)
+        return 0
+
+    # Keep the server's caches, rollups and history out of the working tree
+    workdir = tempfile.mkdtemp(prefix="query_osmosis_loadtest_")
+    home = os.path.join(workdir, "home")
+    os.makedirs(os.path.join(home, ".streamlit"))
+    with open(os.path.join(home, ".streamlit", "secrets.toml"), "w") as f:
+        f.write('API_KEY = "loadtest"\n')
+    env = dict(
+        os.environ,
+        HOME=home,
+        QUERY_OSMOSIS_ROLLUP_DB=os.path.join(workdir, "rollups.sqlite"),
+        QUERY_OSMOSIS_RESULT_CACHE_DIR=os.path.join(workdir, "results"),
+        QUERY_OSMOSIS_SPILL_DIR=os.path.join(workdir, "spill"),
+        QUERY_OSMOSIS_SHARD_CACHE_DIR=os.path.join(workdir, "shards"),
+        QUERY_OSMOSIS_HISTORY=os.path.join(workdir, "query_history.jsonl"),
+        QUERY_OSMOSIS_WARMUP_REPORT=os.path.join(workdir, "warmup_report.json"),
+        QUERY_OSMOSIS_WARMUP_ON_START="0",
+    )
+    stats_path = os.path.join(workdir, "stats.json")
+    server = subprocess.Popen(
+        [
+            sys.executable, __file__, "--serve", "--port", str(args.port), "--stats", stats_path,
+            "--latency", str(args.latency), "--latency-sigma", str(args.latency_sigma), "--rows", str(args.rows),
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        _wait_until_healthy(args.port, server)
+        runs, errors, elapsed = asyncio.run(
+            run_sessions(
+                f"ws://127.0.0.1:{args.port}/_stcore/stream",
+                args.sessions,
+                args.duration,
+                args.think_time,
+                args.query_probability,
+                args.ramp_up,
+            )
+        )
+        time.sleep(1)
+        with open(stats_path) as f:
+            stats = json.load(f)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [seconds for _, seconds in runs]
+    report = {
+        "sessions": args.sessions,
+        "duration_s": round(elapsed, 1),
+        "script_runs": len(runs),
+        "throughput_runs_per_s": round(len(runs) / elapsed, 2),
+        "latency_p50_s": percentile(latencies, 0.50),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "latency_p99_s": percentile(latencies, 0.99),
+        "by_kind": {
+            kind: {
+                "runs": len(values),
+                "p50_s": percentile(values, 0.50),
+                "p95_s": percentile(values, 0.95),
+                "p99_s": percentile(values, 0.99),
+            }
+            for kind in ("load", "query", "rerun")
+            for values in [[seconds for k, seconds in runs if k == kind]]
+        },
+        "provider_calls": stats["provider_calls"],
+        "provider_calls_per_session": round(stats["provider_calls"] / args.sessions, 2),
+        "peak_rss_mb": round(stats["peak_rss_bytes"] / 2**20, 1),
+        "session_errors": errors,
+    }
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
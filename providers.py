@@ -0,0 +1,312 @@
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import pyarrow.parquet as pq
+from shroomdk import ShroomDK
+
+from bulk_fetch import BULK_RESULTS_URL, fetch_bulk
+from flipside_fetch import FetchCancelled, FetchState, fetch_pages
+from result_store import store_table
+from scheduler import MAX_CONCURRENT_QUERIES
+
+RESULT_CACHE_DIR = os.environ.get(
+    "QUERY_OSMOSIS_RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "query_osmosis_results")
+)
+# Hedge once the primary has been running longer than this quantile of its
+# observed latencies, but never sooner than the minimum delay
+HEDGE_QUANTILE = float(os.environ.get("QUERY_OSMOSIS_HEDGE_QUANTILE", 0.95))
+MIN_HEDGE_DELAY = float(os.environ.get("QUERY_OSMOSIS_MIN_HEDGE_DELAY", 2.0))
+# Used until enough latencies have been observed
+DEFAULT_HEDGE_DELAY = float(os.environ.get("QUERY_OSMOSIS_DEFAULT_HEDGE_DELAY", 30.0))
+# Cached results younger than this are served without a remote call. The SDK
+# reuses a query run for up to 5 minutes by default (max_age_minutes), so a
+# cached result is never staler than a re-submitted query would be.
+RESULT_CACHE_TTL = float(os.environ.get("QUERY_OSMOSIS_RESULT_CACHE_TTL", 300))
+FAILURE_THRESHOLD = 3
+COOLDOWN_SECONDS = 30.0
+
+
+class ProviderUnavailable(Exception):
+    pass
+
+
+def query_key(q):
+    return hashlib.sha256(q.strip().encode()).hexdigest()
+
+
+# Runs queries against the Flipside API. A second instance with another key
+# or base URL can act as a secondary provider. With `bulk_url` set, results
+# are downloaded in a columnar format instead of as JSON pages.
+class FlipsideProvider:
+    def __init__(
+        self, api_key, name="Flipside", api_base_url=None, before_page=None, bulk_url=BULK_RESULTS_URL
+    ):
+        self.name = name
+        self.api_key = api_key
+        self.api_base_url = api_base_url
+        self.before_page = before_page
+        self.bulk_url = bulk_url
+
+    # Setting the `cancel` event stops the fetch before its next page request
+    def execute(self, q, state=None, cancel=None):
+        if self.api_base_url:
+            sdk = ShroomDK(self.api_key, self.api_base_url)
+        else:
+            sdk = ShroomDK(self.api_key)
+
+        def before_page():
+            if cancel is not None and cancel.is_set():
+                raise FetchCancelled()
+            if self.before_page is not None:
+                self.before_page()
+
+        if self.bulk_url and state is None:
+            return fetch_bulk(sdk, q, self.bulk_url, api_key=self.api_key, before_page=before_page)
+        return fetch_pages(sdk, q, state=state, before_page=before_page)
+
+
+# Serves results of earlier successful runs from local Parquet files. Entries
+# older than `max_age` seconds are treated as missing.
+class ResultCacheProvider:
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_age=None, name="Local cache"):
+        self.name = name
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+
+    def _path(self, q):
+        return os.path.join(self.cache_dir, f"{query_key(q)}.parquet")
+
+    def age(self, q):
+        path = self._path(q)
+        if not os.path.exists(path):
+            return None
+        return time.time() - os.path.getmtime(path)
+
+    def execute(self, q, state=None, cancel=None):
+        age = self.age(q)
+        if age is None or (self.max_age is not None and age > self.max_age):
+            raise ProviderUnavailable("no cached result")
+        return FetchState.finished(q, store_table(pq.read_table(self._path(q), memory_map=True)))
+
+    def put(self, q, result):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(q)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        result.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+
+
+# Latency history and a simple circuit breaker for one provider
+class ProviderHealth:
+    def __init__(self):
+        self.latencies = collections.deque(maxlen=200)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.successes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.open_until
+
+    def record_success(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.open_until = 0.0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= FAILURE_THRESHOLD:
+                self.open_until = time.monotonic() + COOLDOWN_SECONDS
+
+    def quantile(self, q):
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < 10:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+# Sends each query to the first healthy provider. If it has not answered
+# after its observed p95 latency, the same query is also sent to the next
+# provider and whichever complete result arrives first is used; failed
+# providers are skipped over. Successful results are written to `cache`,
+# which answers directly while they are younger than `cache_ttl`. Older
+# cached results are only a failover once every remote provider has failed,
+# never a hedge, so a slow query is not answered from a stale copy.
+class ProviderRouter:
+    def __init__(
+        self,
+        providers,
+        cache=None,
+        hedge_quantile=HEDGE_QUANTILE,
+        cache_ttl=RESULT_CACHE_TTL,
+        max_concurrent=MAX_CONCURRENT_QUERIES,
+    ):
+        self.providers = list(providers)
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.hedge_quantile = hedge_quantile
+        self.health = {provider.name: ProviderHealth() for provider in self.providers}
+        # Every query that may run at once needs room for its primary, a
+        # hedge and a cancelled loser finishing its current page
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=3 * max(1, max_concurrent))
+
+    # Healthy providers in configured order, then the unhealthy ones as a
+    # last resort
+    def _candidates(self):
+        healthy = [p for p in self.providers if self.health[p.name].healthy]
+        return healthy + [p for p in self.providers if p not in healthy]
+
+    def _hedge_delay(self, provider):
+        p95 = self.health[provider.name].quantile(self.hedge_quantile)
+        if p95 is None:
+            return DEFAULT_HEDGE_DELAY
+        return max(MIN_HEDGE_DELAY, p95)
+
+    def _call(self, provider, q, state, cancel=None):
+        started = time.monotonic()
+        try:
+            fetch = provider.execute(q, state=state, cancel=cancel)
+        except (ProviderUnavailable, FetchCancelled):
+            raise
+        except Exception:
+            self.health[provider.name].record_failure()
+            raise
+        if fetch.error is not None:
+            self.health[provider.name].record_failure()
+        else:
+            self.health[provider.name].record_success(time.monotonic() - started)
+        fetch.provider = provider.name
+        return fetch
+
+    def execute(self, q, state=None, use_cache=True):
+        # A partial fetch can only be resumed by the provider that started it
+        if state is not None and getattr(state, "provider", None) is not None:
+            provider = next(p for p in self.providers if p.name == state.provider)
+            return self._call(provider, q, state)
+
+        if use_cache and self.cache is not None and self.cache_ttl:
+            age = self.cache.age(q)
+            if age is not None and age <= self.cache_ttl:
+                fetch = self.cache.execute(q)
+                fetch.provider = self.cache.name
+                return fetch
+
+        candidates = [p for p in self._candidates() if p is not self.cache]
+        # Future -> (provider, cancel event). Losing calls are cancelled so
+        # they stop fetching pages once the winner has been returned.
+        pending = {}
+        errors = []
+        partial = None
+        while candidates or pending:
+            if candidates and (not pending or len(pending) < 2):
+                provider = candidates.pop(0)
+                cancel = threading.Event()
+                pending[self._pool.submit(self._call, provider, q, None, cancel)] = (provider, cancel)
+            timeout = self._hedge_delay(next(iter(pending.values()))[0]) if candidates else None
+            done, _ = concurrent.futures.wait(
+                pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                # Primary is slower than usual: hedge with the next provider
+                provider = candidates.pop(0)
+                cancel = threading.Event()
+                pending[self._pool.submit(self._call, provider, q, None, cancel)] = (provider, cancel)
+                continue
+            for future in done:
+                provider, _ = pending.pop(future)
+                try:
+                    fetch = future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+                    continue
+                if fetch.error is not None:
+                    if partial is None:
+                        partial = fetch
+                    else:
+                        fetch.result.release()
+                    continue
+                for other, (_, cancel) in pending.items():
+                    cancel.set()
+                    other.add_done_callback(functools.partial(self._settle_loser, q))
+                if partial is not None:
+                    partial.result.release()
+                if self.cache is not None and provider is not self.cache:
+                    self.cache.put(q, fetch.result)
+                return fetch
+        # Without use_cache, stale results must not come back by failover
+        # either
+        if use_cache and self.cache is not None:
+            try:
+                fetch = self._call(self.cache, q, None)
+            except Exception as e:
+                errors.append(f"{self.cache.name}: {e}")
+            else:
+                if partial is not None:
+                    partial.result.release()
+                return fetch
+        if partial is not None:
+            return partial
+        raise ProviderUnavailable("; ".join(errors) or "no provider available")
+
+    # A hedged call that lost the race but still completed has a fresh
+    # result: cache it, then release it
+    def _settle_loser(self, q, future):
+        try:
+            fetch = future.result()
+        except Exception:
+            return
+        if fetch.result is None:
+            return
+        try:
+            if fetch.error is None and self.cache is not None:
+                self.cache.put(q, fetch.result)
+        finally:
+            fetch.result.release()
+
+    def status(self):
+        rows = []
+        for provider in self.providers:
+            health = self.health[provider.name]
+            rows.append(
+                {
+                    "provider": provider.name,
+                    "healthy": health.healthy,
+                    "successes": health.successes,
+                    "failures": health.failures,
+                    "p95_s": health.quantile(0.95),
+                }
+            )
+        return rows
+
+
+# The standard setup: Flipside first, an optional secondary Flipside key or
+# endpoint, and the local result cache as the last resort
+def build_router(
+    api_key, secondary_api_key=None, secondary_base_url=None, before_page=None, max_concurrent=MAX_CONCURRENT_QUERIES
+):
+    result_cache = ResultCacheProvider()
+    providers = [FlipsideProvider(api_key, before_page=before_page)]
+    if secondary_api_key or secondary_base_url:
+        providers.append(
+            FlipsideProvider(
+                secondary_api_key or api_key,
+                name="Flipside (secondary)",
+                api_base_url=secondary_base_url,
+                before_page=before_page,
+            )
+        )
+    providers.append(result_cache)
+    return ProviderRouter(providers, cache=result_cache, max_concurrent=max_concurrent)
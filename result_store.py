@@ -0,0 +1,255 @@
+import os
+import tempfile
+import uuid
+import weakref
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Results larger than this many MB are spilled to disk instead of kept in memory
+RESULT_MEMORY_BUDGET_MB = float(os.environ.get("QUERY_OSMOSIS_RESULT_BUDGET_MB", 64))
+SPILL_DIR = os.environ.get(
+    "QUERY_OSMOSIS_SPILL_DIR", os.path.join(tempfile.gettempdir(), "query_osmosis_spill")
+)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _spill_path():
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    return os.path.join(SPILL_DIR, f"{uuid.uuid4().hex}.arrow")
+
+
+def frame_nbytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# A query result that either lives in memory as a DataFrame or in a
+# memory-mapped Arrow IPC file. Spilled results only materialize the rows
+# of the page being displayed.
+class StoredResult:
+    def __init__(self, df=None, path=None):
+        self._df = df
+        self._table = None
+        self._sort_cache = {}
+        self.path = path
+        if path is not None:
+            self._table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+            self._finalizer = weakref.finalize(self, _remove_file, path)
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    @property
+    def num_rows(self):
+        if self.spilled:
+            return self._table.num_rows
+        return len(self._df)
+
+    @property
+    def columns(self):
+        if self.spilled:
+            return list(self._table.column_names)
+        return list(self._df.columns)
+
+    @property
+    def nbytes(self):
+        # Resident size: spilled results are backed by the page cache, not the heap
+        if self.spilled:
+            return 0
+        return frame_nbytes(self._df)
+
+    def to_pandas(self):
+        if self.spilled:
+            return self._table.to_pandas()
+        return self._df
+
+    def to_parquet(self, path):
+        if self.spilled:
+            pq.write_table(self._table, path)
+        else:
+            self._df.to_parquet(path, index=False)
+
+    def _sort_indices(self, sort_by, ascending):
+        key = (sort_by, ascending)
+        if key not in self._sort_cache:
+            order = "ascending" if ascending else "descending"
+            self._sort_cache = {
+                key: pc.sort_indices(
+                    self._table, sort_keys=[(sort_by, order)], null_placement="at_end"
+                )
+            }
+        return self._sort_cache[key]
+
+    # Return rows [page_number * page_size, (page_number + 1) * page_size)
+    # of the result, optionally sorted by a column
+    def page(self, page_number, page_size, sort_by=None, ascending=True):
+        offset = page_number * page_size
+        if not self.spilled:
+            df = self._df
+            if sort_by is not None:
+                df = df.sort_values(by=sort_by, ascending=ascending, na_position="last")
+            return df.iloc[offset : offset + page_size]
+        if sort_by is None:
+            rows = self._table.slice(offset, page_size)
+        else:
+            indices = self._sort_indices(sort_by, ascending).slice(offset, page_size)
+            rows = self._table.take(indices)
+        df = rows.to_pandas()
+        df.index = range(offset, offset + len(df))
+        return df
+
+    def release(self):
+        self._df = None
+        self._table = None
+        self._sort_cache = {}
+        if self.spilled:
+            self._finalizer()
+
+
+# Common type for a column that was written with different types in
+# different spill segments: integers widen to int64, mixed numbers to
+# float64, anything else falls back to string
+def _common_type(types):
+    types = [t for t in types if not pa.types.is_null(t)]
+    if not types:
+        return pa.string()
+    if all(t == types[0] for t in types):
+        return types[0]
+    if all(pa.types.is_integer(t) for t in types):
+        return pa.int64()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        return pa.float64()
+    return pa.string()
+
+
+# `table` with the columns of `schema`, missing ones filled with nulls, or
+# None when a column is new or its values cannot be stored as-is and `cast`
+# is off. With `cast`, values are converted to the schema's types.
+def _conform(table, schema, cast=False):
+    if not set(table.column_names) <= set(schema.names):
+        return None
+    columns = []
+    for field in schema:
+        if field.name not in table.column_names:
+            columns.append(pa.nulls(table.num_rows, field.type))
+            continue
+        column = table.column(field.name)
+        if column.type != field.type:
+            if not (cast or pa.types.is_null(column.type)):
+                return None
+            column = column.cast(field.type)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+# Accumulates result pages and switches to on-disk Arrow files once the
+# buffered pages exceed the memory budget. Pages whose columns or types do
+# not fit the current file start a new segment; segments are merged into a
+# single file with a widened schema when the result is finished.
+class ResultBuilder:
+    def __init__(self, budget_mb=None):
+        if budget_mb is None:
+            budget_mb = RESULT_MEMORY_BUDGET_MB
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._frames = []
+        self._buffered_bytes = 0
+        self._writer = None
+        self._schema = None
+        # (path, inferred schema) per segment, the inferred schema keeping
+        # all-null columns as null so they do not pin the merged type
+        self._segments = []
+
+    def _open_spill(self):
+        frames, self._frames = self._frames, []
+        for frame in frames:
+            self._write(frame)
+
+    def _write(self, frame):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if self._writer is not None:
+            conformed = _conform(table, self._schema)
+            if conformed is not None:
+                self._writer.write_table(conformed)
+                return
+            self._writer.close()
+        path = _spill_path()
+        # Columns that are entirely null so far are stored as strings
+        self._schema = pa.schema(
+            [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema]
+        )
+        self._writer = pa.ipc.new_file(path, self._schema)
+        self._segments.append((path, table.schema))
+        self._writer.write_table(table.cast(self._schema))
+
+    def _merge_segments(self):
+        names = list(dict.fromkeys(name for _, schema in self._segments for name in schema.names))
+        schema = pa.schema(
+            [
+                (name, _common_type([s.field(name).type for _, s in self._segments if name in s.names]))
+                for name in names
+            ]
+        )
+        path = _spill_path()
+        with pa.ipc.new_file(path, schema) as writer:
+            for segment_path, _ in self._segments:
+                reader = pa.ipc.open_file(pa.memory_map(segment_path, "r"))
+                for i in range(reader.num_record_batches):
+                    writer.write_table(_conform(pa.Table.from_batches([reader.get_batch(i)]), schema, cast=True))
+                _remove_file(segment_path)
+        return path
+
+    def append(self, frame):
+        if self._writer is not None:
+            self._write(frame)
+            return
+        self._frames.append(frame)
+        self._buffered_bytes += frame_nbytes(frame)
+        if self._buffered_bytes > self.budget_bytes:
+            self._open_spill()
+
+    # Append the rows of an existing result, batch by batch if it was spilled
+    def extend(self, result):
+        if not result.spilled:
+            if result.num_rows:
+                self.append(result.to_pandas())
+            return
+        for batch in result._table.to_batches():
+            self.append(batch.to_pandas())
+
+    def finish(self):
+        if self._writer is None:
+            if not self._frames:
+                return StoredResult(df=pd.DataFrame())
+            return StoredResult(df=pd.concat(self._frames, ignore_index=True))
+        self._writer.close()
+        if len(self._segments) == 1:
+            return StoredResult(path=self._segments[0][0])
+        return StoredResult(path=self._merge_segments())
+
+
+def store_result(df, budget_mb=None):
+    builder = ResultBuilder(budget_mb)
+    builder.append(df)
+    return builder.finish()
+
+
+# Store an Arrow table, writing it straight to a spill file when it is over
+# budget so it never goes through pandas
+def store_table(table, budget_mb=None):
+    if budget_mb is None:
+        budget_mb = RESULT_MEMORY_BUDGET_MB
+    if table.nbytes <= budget_mb * 1024 * 1024:
+        return StoredResult(df=table.to_pandas())
+    path = _spill_path()
+    with pa.ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+    return StoredResult(path=path)
@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from dashboard_queries import DAILY_STAKING_SQL, DAILY_TRANSFERS_SQL, MARS_TVL_SQL
+from scheduler import DASHBOARD
+from sql_rewrite import rewrite
+
+ROLLUP_DB = os.environ.get("QUERY_OSMOSIS_ROLLUP_DB", "rollups.sqlite")
+ROLLUP_INTERVAL = float(os.environ.get("QUERY_OSMOSIS_ROLLUP_INTERVAL", 3600))
+# Wait before retrying a rollup whose last refresh failed
+ROLLUP_RETRY_INTERVAL = float(os.environ.get("QUERY_OSMOSIS_ROLLUP_RETRY_INTERVAL", 300))
+# Submit the rollup queries through the scan-merging optimizer
+ROLLUP_OPTIMIZE_SQL = os.environ.get("QUERY_OSMOSIS_ROLLUP_OPTIMIZE_SQL", "0") == "1"
+
+
+# A local table kept up to date from a dashboard query. Each refresh
+# replaces the rows from the earliest `time_column` value it returned
+# onwards, so history older than the query's window is retained.
+class Rollup:
+    def __init__(self, name, sql, time_column, interval=ROLLUP_INTERVAL, optimize=ROLLUP_OPTIMIZE_SQL):
+        self.name = name
+        self.sql = rewrite(sql).sql if optimize else sql
+        self.time_column = time_column
+        self.interval = interval
+
+
+ROLLUPS = [
+    Rollup("daily_transfers_by_type", DAILY_TRANSFERS_SQL, "date"),
+    Rollup("daily_staking_by_action", DAILY_STAKING_SQL, "date"),
+    Rollup("hourly_mars_flows_tvl", MARS_TVL_SQL, "dt"),
+]
+
+
+class RollupStore:
+    def __init__(self, path=ROLLUP_DB):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("pragma journal_mode=wal")
+            conn.execute(
+                "create table if not exists _rollup_status ("
+                "name text primary key, last_attempt_at real, last_success_at real, "
+                "duration_s real, row_count integer, error text)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _has_table(self, conn, name):
+        row = conn.execute(
+            "select 1 from sqlite_master where type = 'table' and name = ?", (name,)
+        ).fetchone()
+        return row is not None
+
+    def write(self, rollup, df):
+        df = df.copy()
+        df[rollup.time_column] = pd.to_datetime(df[rollup.time_column]).dt.tz_localize(None)
+        with self._connect() as conn:
+            if self._has_table(conn, rollup.name) and len(df):
+                since = df[rollup.time_column].min().strftime("%Y-%m-%d %H:%M:%S")
+                conn.execute(f"delete from {rollup.name} where {rollup.time_column} >= ?", (since,))
+            df.to_sql(rollup.name, conn, if_exists="append", index=False)
+
+    def read(self, name, time_column, since=None):
+        with self._connect() as conn:
+            if not self._has_table(conn, name):
+                return pd.DataFrame()
+            sql = f"select * from {name}"
+            params = ()
+            if since is not None:
+                sql += f" where {time_column} >= ?"
+                params = (pd.Timestamp(since).strftime("%Y-%m-%d %H:%M:%S"),)
+            sql += f" order by {time_column}"
+            return pd.read_sql_query(sql, conn, params=params, parse_dates=[time_column])
+
+    def record_status(self, name, duration_s, row_count=None, error=None):
+        now = time.time()
+        with self._connect() as conn:
+            previous = conn.execute(
+                "select last_success_at from _rollup_status where name = ?", (name,)
+            ).fetchone()
+            last_success_at = now if error is None else (previous[0] if previous else None)
+            conn.execute(
+                "insert or replace into _rollup_status values (?, ?, ?, ?, ?, ?)",
+                (name, now, last_success_at, duration_s, row_count, error),
+            )
+
+    def status(self):
+        with self._connect() as conn:
+            return pd.read_sql_query("select * from _rollup_status order by name", conn)
+
+    # Seconds since the last refresh attempt and since the last successful
+    # one, either None if there was none
+    def ages(self, name):
+        with self._connect() as conn:
+            row = conn.execute(
+                "select last_attempt_at, last_success_at from _rollup_status where name = ?", (name,)
+            ).fetchone()
+        now = time.time()
+        if row is None:
+            return None, None
+        return now - row[0], None if row[1] is None else now - row[1]
+
+
+def read_rollup(name, since=None, store=None):
+    store = store or RollupStore()
+    rollup = next(r for r in ROLLUPS if r.name == name)
+    return store.read(rollup.name, rollup.time_column, since=since)
+
+
+# execute(sql) for the materializer: runs through `scheduler` at dashboard
+# priority and always goes to a remote provider, bypassing the result cache
+def remote_executor(router, scheduler):
+    def execute(sql):
+        fetch = scheduler.run(
+            lambda: router.execute(sql, use_cache=False),
+            session_id="rollup-materializer",
+            priority=DASHBOARD,
+        )
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.result.to_pandas()
+
+    return execute
+
+
+# Background job that refreshes each rollup once its interval has elapsed.
+# `execute(sql)` runs a statement remotely and returns a DataFrame.
+class RollupMaterializer:
+    def __init__(self, execute, store=None, rollups=ROLLUPS, poll_seconds=30):
+        self.execute = execute
+        self.store = store or RollupStore()
+        self.rollups = rollups
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self, rollup):
+        started = time.monotonic()
+        try:
+            df = self.execute(rollup.sql)
+            self.store.write(rollup, df)
+        except Exception as e:
+            self.store.record_status(rollup.name, time.monotonic() - started, error=str(e))
+            return False
+        self.store.record_status(rollup.name, time.monotonic() - started, row_count=len(df))
+        return True
+
+    def is_due(self, rollup):
+        attempt_age, success_age = self.store.ages(rollup.name)
+        if attempt_age is None:
+            return True
+        if success_age is None or success_age > attempt_age:
+            return attempt_age >= min(rollup.interval, ROLLUP_RETRY_INTERVAL)
+        return success_age >= rollup.interval
+
+    def refresh_due(self):
+        for rollup in self.rollups:
+            if self._stop.is_set():
+                return
+            if self.is_due(rollup):
+                self.refresh(rollup)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh_due()
+            self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rollup-materializer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,141 @@
+import collections
+import os
+import threading
+import time
+
+# Priority classes, lower runs first
+DASHBOARD = 0
+EDITOR = 1
+PRIORITY_NAMES = {DASHBOARD: "dashboard", EDITOR: "editor"}
+
+MAX_CONCURRENT_QUERIES = int(os.environ.get("QUERY_OSMOSIS_MAX_CONCURRENT_QUERIES", 4))
+PAGE_REQUESTS_PER_SECOND = float(os.environ.get("QUERY_OSMOSIS_PAGE_RATE", 2))
+PAGE_REQUEST_BURST = int(os.environ.get("QUERY_OSMOSIS_PAGE_BURST", 5))
+
+
+# Classic token bucket: `rate` tokens are added per second up to `capacity`,
+# each acquire takes one token and blocks until one is available
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class _Ticket:
+    def __init__(self, session_id, priority):
+        self.session_id = session_id
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# Process-wide gate in front of remote query execution. At most
+# `max_concurrent` queries run at once; waiting queries are served by
+# priority and, within a priority, round-robin across sessions so that one
+# session queueing many queries cannot starve the others.
+class QueryScheduler:
+    def __init__(
+        self,
+        max_concurrent=MAX_CONCURRENT_QUERIES,
+        page_rate=PAGE_REQUESTS_PER_SECOND,
+        page_burst=PAGE_REQUEST_BURST,
+    ):
+        self.max_concurrent = max_concurrent
+        self.page_bucket = TokenBucket(page_rate, page_burst)
+        self._cond = threading.Condition()
+        # priority -> session_id -> deque of tickets, in round-robin order
+        self._queues = {DASHBOARD: collections.OrderedDict(), EDITOR: collections.OrderedDict()}
+        self._running = 0
+        self._waits = {p: collections.deque(maxlen=500) for p in self._queues}
+        self._completed = 0
+
+    def _next_ticket(self):
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            if sessions:
+                session_id, tickets = next(iter(sessions.items()))
+                ticket = tickets.popleft()
+                del sessions[session_id]
+                if tickets:
+                    sessions[session_id] = tickets  # back of the rotation
+                return ticket
+        return None
+
+    def _dispatch(self):
+        while self._running < self.max_concurrent:
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            ticket.granted = True
+            self._running += 1
+            self._waits[ticket.priority].append(time.monotonic() - ticket.enqueued)
+        self._cond.notify_all()
+
+    def _release(self):
+        with self._cond:
+            self._running -= 1
+            self._completed += 1
+            self._dispatch()
+
+    # Run `fn()` once a slot is granted to this session and priority
+    def run(self, fn, session_id=None, priority=EDITOR):
+        ticket = _Ticket(session_id, priority)
+        with self._cond:
+            self._queues[priority].setdefault(session_id, collections.deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                self._cond.wait()
+        try:
+            return fn()
+        finally:
+            self._release()
+
+    # Block until the shared API key may issue another page request
+    def page_permit(self):
+        self.page_bucket.acquire()
+
+    def metrics(self):
+        with self._cond:
+            metrics = {
+                "running": self._running,
+                "max_concurrent": self.max_concurrent,
+                "completed": self._completed,
+                "queue_depth": 0,
+            }
+            for priority, sessions in self._queues.items():
+                name = PRIORITY_NAMES[priority]
+                depth = sum(len(tickets) for tickets in sessions.values())
+                waits = list(self._waits[priority])
+                metrics["queue_depth"] += depth
+                metrics[f"{name}_queue_depth"] = depth
+                metrics[f"{name}_wait_p50_s"] = _percentile(waits, 0.5)
+                metrics[f"{name}_wait_p95_s"] = _percentile(waits, 0.95)
+            return metrics
+
+
+default_scheduler = QueryScheduler()
@@ -0,0 +1,148 @@
+import os
+import resource
+import sys
+import threading
+import time
+
+# Release a session's results once it has been idle this long
+SESSION_IDLE_TIMEOUT = float(os.environ.get("QUERY_OSMOSIS_SESSION_IDLE_TIMEOUT", 1800))
+# Above this resident size, results are released in least recently used
+# order across sessions. 0 disables the ceiling.
+MEMORY_CEILING_MB = float(os.environ.get("QUERY_OSMOSIS_MEMORY_CEILING_MB", 0))
+# Sessions seen more recently than this may be rendering their results and
+# are never evicted for the ceiling
+ACTIVE_GRACE_SECONDS = 60.0
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _Entry:
+    def __init__(self, nbytes, evict):
+        self.nbytes = nbytes
+        self.evict = evict
+
+
+# Accounts the large objects each session holds and releases them when the
+# session goes idle or the process nears its memory ceiling. Objects are
+# registered with `track(session_id, key, nbytes, evict)`; `evict()` must
+# drop the session's reference and free the object.
+class SessionMemory:
+    def __init__(
+        self,
+        idle_timeout=SESSION_IDLE_TIMEOUT,
+        ceiling_mb=MEMORY_CEILING_MB,
+        poll_seconds=30,
+        rss=current_rss_bytes,
+    ):
+        self.idle_timeout = idle_timeout
+        self.ceiling_bytes = ceiling_mb * 1024 * 1024
+        self.poll_seconds = poll_seconds
+        self.rss = rss
+        self._lock = threading.Lock()
+        self._last_seen = {}
+        self._entries = {}  # session_id -> key -> _Entry
+        self._evicted = {}  # session_id -> bytes released so far
+        self._stop = threading.Event()
+        self._thread = None
+
+    def touch(self, session_id, now=None):
+        with self._lock:
+            self._last_seen[session_id] = time.time() if now is None else now
+
+    def track(self, session_id, key, nbytes, evict):
+        with self._lock:
+            self._entries.setdefault(session_id, {})[key] = _Entry(nbytes, evict)
+            self._last_seen.setdefault(session_id, time.time())
+
+    def untrack(self, session_id, key):
+        with self._lock:
+            self._entries.get(session_id, {}).pop(key, None)
+
+    def _evict(self, session_id, key):
+        with self._lock:
+            entry = self._entries.get(session_id, {}).pop(key, None)
+            if entry is None:
+                return 0
+            self._evicted[session_id] = self._evicted.get(session_id, 0) + entry.nbytes
+        entry.evict()
+        return entry.nbytes
+
+    def evict_session(self, session_id):
+        with self._lock:
+            keys = list(self._entries.get(session_id, {}))
+        return sum(self._evict(session_id, key) for key in keys)
+
+    # Release idle sessions, then, above the ceiling, the largest objects of
+    # the least recently seen sessions until the tracked excess is released
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            by_age = sorted(self._last_seen, key=self._last_seen.get)
+            idle = [s for s in by_age if now - self._last_seen[s] >= self.idle_timeout]
+        released = sum(self.evict_session(session_id) for session_id in idle)
+        with self._lock:
+            for session_id in idle:
+                self._entries.pop(session_id, None)
+                self._last_seen.pop(session_id, None)
+        if not self.ceiling_bytes:
+            return released
+        excess = self.rss() - self.ceiling_bytes
+        for session_id in by_age:
+            if excess <= 0:
+                break
+            with self._lock:
+                if now - self._last_seen.get(session_id, now) < ACTIVE_GRACE_SECONDS:
+                    continue
+                entries = sorted(self._entries.get(session_id, {}).items(), key=lambda item: -item[1].nbytes)
+            for key, _ in entries:
+                freed = self._evict(session_id, key)
+                released += freed
+                excess -= freed
+                if excess <= 0:
+                    break
+        return released
+
+    def report(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            sessions = [
+                {
+                    "session": session_id,
+                    "idle_s": round(now - last_seen, 1),
+                    "objects": len(self._entries.get(session_id, {})),
+                    "mb": round(sum(e.nbytes for e in self._entries.get(session_id, {}).values()) / 2**20, 2),
+                    "evicted_mb": round(self._evicted.get(session_id, 0) / 2**20, 2),
+                }
+                for session_id, last_seen in sorted(self._last_seen.items(), key=lambda item: -item[1])
+            ]
+        return {
+            "rss_mb": round(self.rss() / 2**20, 1),
+            "ceiling_mb": round(self.ceiling_bytes / 2**20, 1) or None,
+            "tracked_mb": round(sum(s["mb"] for s in sessions), 2),
+            "sessions": sessions,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.sweep()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="session-memory", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
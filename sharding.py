@@ -0,0 +1,143 @@
+import concurrent.futures
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+import pandas as pd
+
+from result_store import ResultBuilder
+from sql_rewrite import mask
+
+# First day of Osmosis chain history, the default start of a full scan
+OSMOSIS_GENESIS = "2021-06-19"
+SHARD_CACHE_DIR = os.environ.get(
+    "QUERY_OSMOSIS_SHARD_CACHE_DIR", os.path.join(tempfile.gettempdir(), "query_osmosis_shards")
+)
+MAX_CONCURRENT_SHARDS = int(os.environ.get("QUERY_OSMOSIS_MAX_CONCURRENT_SHARDS", 4))
+# Flipside ingests with a lag, so a range is only cached once it ended this
+# long ago
+SHARD_SETTLE_HOURS = float(os.environ.get("QUERY_OSMOSIS_SHARD_SETTLE_HOURS", 24))
+
+# Placeholders a query can use to place the shard range itself, e.g.
+#   where block_timestamp >= :shard_start and block_timestamp < :shard_end
+SHARD_START = ":shard_start"
+SHARD_END = ":shard_end"
+
+PARTITION_FREQUENCIES = {"day": "D", "week": "W-MON", "month": "MS", "quarter": "QS"}
+
+# Top-level clauses whose output rows do not each belong to one partition:
+# limits, grouping, DISTINCT and aggregates that are not window functions
+_UNWRAPPABLE = re.compile(
+    r"\b(?:limit|top|qualify|distinct|group\s+by)\b"
+    r"|\b(?:count|sum|avg|min|max|median|listagg|array_agg|approx_count_distinct)\s*\(\s*\)(?!\s*over\b)"
+)
+
+
+class ShardingError(Exception):
+    pass
+
+
+# Split [start, end) into consecutive ranges aligned to `frequency`
+def make_partitions(start, end, frequency="month"):
+    start = pd.Timestamp(start).normalize()
+    end = pd.Timestamp(end)
+    edges = pd.date_range(start, end, freq=PARTITION_FREQUENCIES[frequency])
+    edges = [start] + [edge for edge in edges if start < edge < end] + [end]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _literal(ts):
+    return f"'{ts.strftime('%Y-%m-%d %H:%M:%S')}'"
+
+
+# `masked` with the contents of every parenthesis group blanked, leaving the
+# outermost statement's own clauses
+def _outer_clauses(masked):
+    chars, depth = [], 0
+    for ch in masked:
+        if ch == ")":
+            depth = max(0, depth - 1)
+        chars.append(ch if depth == 0 else " ")
+        if ch == "(":
+            depth += 1
+    return "".join(chars)
+
+
+# SQL for a single partition. Queries with the shard placeholders get them
+# substituted; any other query is wrapped and filtered on `time_column`,
+# which is only correct when each output row carries its own timestamp.
+# Wrapping a query that limits, groups or aggregates would give per-partition
+# results, so those are rejected.
+def shard_sql(q, time_column, start, end):
+    if SHARD_START in q or SHARD_END in q:
+        return q.replace(SHARD_START, _literal(start)).replace(SHARD_END, _literal(end))
+    m = _UNWRAPPABLE.search(_outer_clauses(mask(q)))
+    if m:
+        raise ShardingError(
+            f"the query uses {' '.join(m.group().split()).rstrip('( )')} at the top level, so filtering its output "
+            f"on {time_column} would not give the same rows. "
+            f"Place the range yourself with {SHARD_START} and {SHARD_END}."
+        )
+    q = q.strip().rstrip(";")
+    return (
+        f"select * from (\n{q}\n) shard\n"
+        f"where shard.{time_column} >= {_literal(start)} and shard.{time_column} < {_literal(end)}"
+    )
+
+
+def _cache_path(sql):
+    return os.path.join(SHARD_CACHE_DIR, f"{hashlib.sha256(sql.encode()).hexdigest()}.parquet")
+
+
+# Ranges that ended at least `settle_hours` ago can no longer change
+def _is_closed(end, now=None, settle_hours=SHARD_SETTLE_HOURS):
+    now = pd.Timestamp.utcnow().tz_localize(None) if now is None else now
+    return end <= now - pd.Timedelta(hours=settle_hours)
+
+
+# Run one partition, reading closed ranges from the on-disk cache
+def _run_partition(execute, sql, closed):
+    path = _cache_path(sql)
+    if closed and os.path.exists(path):
+        return pd.read_parquet(path), True
+    df = execute(sql)
+    if closed:
+        os.makedirs(SHARD_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    return df, False
+
+
+# Run `q` as one query per time partition, at most `max_workers` at a time,
+# and merge the partitions in time order. `execute(sql)` runs a single
+# statement and returns a DataFrame.
+def run_sharded(
+    q,
+    execute,
+    time_column="block_timestamp",
+    start=OSMOSIS_GENESIS,
+    end=None,
+    frequency="month",
+    max_workers=MAX_CONCURRENT_SHARDS,
+):
+    if end is None:
+        end = pd.Timestamp.utcnow().tz_localize(None).normalize() + pd.Timedelta(days=1)
+    partitions = make_partitions(start, end, frequency)
+    stats = {"partitions": len(partitions), "cached": 0, "fetched": 0}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(
+                _run_partition, execute, shard_sql(q, time_column, p_start, p_end), _is_closed(p_end)
+            )
+            for p_start, p_end in partitions
+        ]
+        builder = ResultBuilder()
+        for future in futures:
+            df, cached = future.result()
+            stats["cached" if cached else "fetched"] += 1
+            if len(df):
+                builder.append(df)
+    return builder.finish(), stats
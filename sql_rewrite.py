@@ -0,0 +1,405 @@
+import difflib
+import re
+
+# Optional optimizer pass for queries before they are submitted. It only
+# applies rewrites that cannot change the result:
+#
+# * identical subqueries that appear more than once (e.g. the same union of
+#   CTEs used twice) are hoisted into one CTE and read from there, if every
+#   name they use resolves inside them or to a top-level CTE;
+# * sibling subqueries that read the same table and differ only in their
+#   WHERE clause read from one shared CTE that scans the table once with the
+#   OR of all their filters. Each subquery keeps its own filter, so it still
+#   sees exactly the rows it saw before. Only filters whose names are all
+#   columns of the table (per the schema data) or CTEs visible where the
+#   shared scan is defined are merged; anything else, such as a select-list
+#   alias or a CTE local to a subquery, would mean something else there.
+#   Scans without a filter are never merged, since the shared scan would
+#   read the whole table, and the shared scan selects only the columns the
+#   subqueries use.
+
+CLAUSE_KEYWORDS = ("where", "group", "order", "having", "qualify", "limit", "join", "left",
+                   "right", "inner", "outer", "full", "cross", "natural", "union", "on", "using")
+NONDETERMINISTIC = re.compile(r"\b(random|uuid_string|seq[1248]|normal|uniform)\s*\(", re.I)
+
+_BARE_NAME = re.compile(r"(?<![\w$.:])([a-z_][\w$]*)\b(?!\s*\(|\s*\.)")
+
+_SIMPLE_SCAN = re.compile(
+    r"^\s*select\s+.+?\s+from\s+(?P<table>[a-z_][\w$]*(?:\.[a-z_][\w$]*){1,2})"
+    r"(?:\s+(?:as\s+)?(?P<alias>[a-z_][\w$]*))?"
+    r"(?:\s+where\s+(?P<pred>.+?))?"
+    r"\s*(?:(?:group\s+by|order\s+by|having|qualify|limit)\b.*)?$",
+    re.S,
+)
+
+
+class RewriteResult:
+    def __init__(self, original, sql, changes):
+        self.original = original
+        self.sql = sql
+        self.changes = changes
+
+    @property
+    def changed(self):
+        return self.sql != self.original
+
+    def diff(self):
+        return "\n".join(
+            difflib.unified_diff(
+                self.original.splitlines(),
+                self.sql.splitlines(),
+                "submitted",
+                "optimized",
+                lineterm="",
+            )
+        )
+
+
+# Lower-case copy of `sql` with the same length in which the contents of
+# string literals, quoted identifiers and comments are blanked out, so
+# structural searches never match inside them
+def mask(sql):
+    out = list(sql.lower())
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch in ("'", '"'):
+            j = i + 1
+            while j < n:
+                if sql[j] == ch and j + 1 < n and sql[j + 1] == ch:
+                    j += 2
+                    continue
+                if sql[j] == ch:
+                    break
+                j += 1
+            for k in range(i + 1, min(j, n)):
+                out[k] = "x"
+            i = j + 1
+        elif sql.startswith("--", i):
+            j = sql.find("\n", i)
+            j = n if j == -1 else j
+            for k in range(i, j):
+                out[k] = " "
+            i = j
+        elif sql.startswith("/*", i):
+            j = sql.find("*/", i + 2)
+            j = n if j == -1 else j + 2
+            for k in range(i, j):
+                out[k] = " "
+            i = j
+        else:
+            i += 1
+    return "".join(out)
+
+
+# (open, close) index pairs of every balanced parenthesis group
+def paren_groups(masked):
+    groups, stack = [], []
+    for i, ch in enumerate(masked):
+        if ch == "(":
+            stack.append(i)
+        elif ch == ")" and stack:
+            groups.append((stack.pop(), i))
+    return sorted(groups)
+
+
+# Text of a group with every nested group blanked, so regexes only see the
+# group's own clauses
+def _top_level(masked, groups, start, end):
+    chars = list(masked[start + 1 : end])
+    for o, c in groups:
+        if start < o and c < end:
+            for k in range(o + 1, c):
+                chars[k - start - 1] = " "
+    return "".join(chars)
+
+
+# Top-level CTEs as (name, name_start, body_open, body_close), plus the
+# index right after the last CTE body
+def top_level_ctes(masked, groups):
+    m = re.match(r"\s*with\s+", masked)
+    if not m:
+        return [], None
+    closes = dict(groups)
+    ctes, pos = [], m.end()
+    while True:
+        m = re.compile(r"\s*(?:recursive\s+)?([a-z_][\w$]*)\s*(?:\([^)]*\)\s*)?as\s*\(").match(masked, pos)
+        if not m:
+            break
+        body_open = m.end() - 1
+        body_close = closes[body_open]
+        ctes.append((m.group(1), m.start(1), body_open, body_close))
+        pos = body_close + 1
+        m = re.compile(r"\s*,").match(masked, pos)
+        if not m:
+            break
+        pos = m.end()
+    end = ctes[-1][3] + 1 if ctes else None
+    return ctes, end
+
+
+def _containing_cte(ctes, pos):
+    for index, (_, _, body_open, body_close) in enumerate(ctes):
+        if body_open <= pos <= body_close:
+            return index
+    return len(ctes)
+
+
+def _referenced_ctes(masked_text, ctes):
+    names = {name for name, _, _, _ in ctes}
+    return {word for word in re.findall(r"[a-z_][\w$]*", masked_text) if word in names}
+
+
+# Insert new CTEs into `sql`. `additions` maps the index of the top-level CTE
+# they must precede (len(ctes) for the main query) to CTE definitions.
+def _insert_ctes(sql, masked, ctes, with_end, additions, edits):
+    if not additions:
+        return
+    if not ctes:
+        start = len(sql) - len(sql.lstrip())
+        definitions = ",\n".join(d for index in sorted(additions) for d in additions[index])
+        edits.append((start, start, f"with {definitions}\n"))
+        return
+    for index, definitions in additions.items():
+        if index < len(ctes):
+            position = ctes[index][1]
+            edits.append((position, position, "".join(f"{d},\n" for d in definitions)))
+        else:
+            edits.append((with_end, with_end, "".join(f",\n{d}" for d in definitions)))
+
+
+def _apply(sql, edits):
+    for start, end, text in sorted(edits, key=lambda e: (e[0], e[1]), reverse=True):
+        sql = sql[:start] + text + sql[end:]
+    return sql
+
+
+def _unique_name(base, sql):
+    name, n = base, 1
+    while re.search(rf"\b{re.escape(name)}\b", sql, re.I):
+        n += 1
+        name = f"{base}_{n}"
+    return name
+
+
+# Subquery defines every alias it qualifies columns with, i.e. it is not
+# correlated with the query around it
+def _is_self_contained(masked_text):
+    defined = set(re.findall(r"\b(?:from|join)\s+[\w$.]+(?:\s+(?:as\s+)?([a-z_][\w$]*))?", masked_text))
+    defined |= set(re.findall(r"\b(?:from|join)\s+(?:[\w$]+\.)*([\w$]+)", masked_text))
+    for qualifier in re.findall(r"\b([a-z_][\w$]*)\.[a-z_*]", masked_text):
+        if qualifier not in defined and not re.search(rf"\b{qualifier}\.[\w$]+\.", masked_text):
+            return False
+    return True
+
+
+def _blank_strings(masked_text):
+    return re.sub(r"'[^']*'", lambda m: " " * len(m.group()), masked_text)
+
+
+# Names the statement in group (start, end) outputs, or None when they
+# cannot be told from its text, e.g. for `select *`
+def _output_columns(masked, groups, start, end, keywords):
+    view = re.split(r"\b(?:union|intersect|except|minus)\b", _top_level(masked, groups, start, end))[0]
+    m = re.search(r"\bselect\s+(?:distinct\s+)?(.*?)(?:\bfrom\b|$)", view, re.S)
+    if not m:
+        return None
+    columns = set()
+    for item in m.group(1).split(","):
+        item = item.strip()
+        named = re.search(r"\bas\s+([a-z_][\w$]*)$", item) or re.fullmatch(r"(?:[a-z_][\w$]*\.)*([a-z_][\w$]*)", item)
+        if not named:
+            named = re.search(r"[\w$)\]]\s+([a-z_][\w$]*)$", item)
+            if not named or named.group(1) in keywords:
+                return None
+        columns.add(named.group(1))
+    return columns
+
+
+# Every bare name in the subquery (o, c) resolves inside it: to a column of
+# a table or CTE it reads, or to an alias or CTE it defines. Anything else
+# may belong to an enclosing query, or to a CTE local to one, and would not
+# exist where the subquery is hoisted to.
+def _resolves_inside(masked, groups, o, c, ctes, schema, keywords):
+    inner = masked[o + 1 : c]
+    closes = dict(groups)
+    sources = {name: (body_open, body_close) for name, _, body_open, body_close in ctes}
+    for m in re.finditer(r"(?:\bwith\s+(?:recursive\s+)?|,\s*)([a-z_][\w$]*)\s*(?:\([^)]*\)\s*)?as\s*\(", inner):
+        body_open = o + m.end()
+        sources[m.group(1)] = (body_open, closes[body_open])
+    defined = set(sources)
+    defined |= set(re.findall(r"\bas\s+([a-z_][\w$]*)", inner))
+    defined |= set(re.findall(r"\)\s*([a-z_][\w$]*)", inner))
+    columns = set()
+    for m in re.finditer(r"\b(?:from|join)\s+([a-z_][\w$]*(?:\.[a-z_][\w$]*)*)(?:\s+(?:as\s+)?([a-z_][\w$]*))?", inner):
+        source, alias = m.groups()
+        if alias:
+            defined.add(alias)
+        if source in schema:
+            columns |= schema[source]
+        elif source in sources:
+            # Unknown outputs add nothing, names that need them fail below
+            columns |= _output_columns(masked, groups, *sources[source], keywords) or set()
+        else:
+            return False
+    names = {name for name in _BARE_NAME.findall(_blank_strings(inner)) if name not in keywords}
+    return names <= defined | columns
+
+
+def dedupe_subqueries(sql, schema=None):
+    # Imported here, sql_validate itself builds on this module
+    from sql_validate import KEYWORDS, load_schema
+
+    schema = load_schema() if schema is None else schema
+    masked = mask(sql)
+    groups = paren_groups(masked)
+    ctes, with_end = top_level_ctes(masked, groups)
+    cte_bodies = {body_open for _, _, body_open, _ in ctes}
+    seen = {}
+    for o, c in groups:
+        if o in cte_bodies:
+            continue
+        inner = masked[o + 1 : c]
+        if not re.match(r"\s*select\b", inner):
+            continue
+        if not re.search(r"\b(union|join)\b|\bfrom\s+[\w$]+\.[\w$]+", inner):
+            continue
+        if NONDETERMINISTIC.search(inner) or '"' in inner or not _is_self_contained(inner):
+            continue
+        if not _resolves_inside(masked, groups, o, c, ctes, schema, KEYWORDS):
+            continue
+        key = " ".join(sql[o + 1 : c].split())
+        seen.setdefault(key, []).append((o, c))
+
+    edits, additions, changes, taken = [], {}, [], []
+    # Largest first, so a repeated subquery nested in another is left alone
+    for key, spans in sorted(seen.items(), key=lambda item: -len(item[0])):
+        spans = [s for s in spans if not any(t[0] <= s[0] and s[1] <= t[1] for t in taken)]
+        if len(spans) < 2:
+            continue
+        first = min(spans)[0]
+        index = _containing_cte(ctes, first)
+        if any(name_index >= index for name_index, (name, _, _, _) in enumerate(ctes)
+               if name in _referenced_ctes(masked[spans[0][0] : spans[0][1]], ctes)):
+            continue
+        name = _unique_name(f"_dedup_{len(changes) + 1}", sql)
+        additions.setdefault(index, []).append(f"{name} as (\n{sql[spans[0][0] + 1 : spans[0][1]].strip()}\n)")
+        for o, c in spans:
+            edits.append((o, c + 1, f"(select * from {name})"))
+        taken.extend(spans)
+        changes.append(f"hoisted a subquery used {len(spans)} times into {name}")
+    _insert_ctes(sql, masked, ctes, with_end, additions, edits)
+    return _apply(sql, edits), changes
+
+
+# Unqualified names a filter uses, other than keywords and function names
+def _filter_names(masked_pred, keywords):
+    return {name for name in _BARE_NAME.findall(_blank_strings(masked_pred)) if name not in keywords}
+
+
+# Columns of `table_columns` the scan subquery (o, c) uses, or None when it
+# selects `*` or quotes an identifier, so all of them are needed
+def _used_columns(masked, groups, o, c, alias, table_columns):
+    inner = masked[o + 1 : c]
+    select_list = re.search(r"\bselect\b(.*?)\bfrom\b", _top_level(masked, groups, o, c), re.S).group(1)
+    if '"' in inner or re.search(r"(?:^|,|\bdistinct|\.)\s*\*", select_list.strip()):
+        return None
+    names = set(_BARE_NAME.findall(_blank_strings(inner)))
+    if alias:
+        names |= set(re.findall(rf"\b{re.escape(alias)}\.([a-z_][\w$]*)", inner))
+    return names & table_columns
+
+
+def merge_sibling_scans(sql, schema=None):
+    # Imported here, sql_validate itself builds on this module
+    from sql_validate import KEYWORDS, load_schema
+
+    schema = load_schema() if schema is None else schema
+    masked = mask(sql)
+    groups = paren_groups(masked)
+    ctes, with_end = top_level_ctes(masked, groups)
+    cte_names = {name for name, _, _, _ in ctes}
+    scans = {}
+    for o, c in groups:
+        view = _top_level(masked, groups, o, c)
+        m = _SIMPLE_SCAN.match(view)
+        if not m or re.search(r"\b(join|union|intersect|except|minus)\b", view):
+            continue
+        alias = m.group("alias")
+        if alias in CLAUSE_KEYWORDS:
+            continue
+        table_start = o + 1 + m.start("table")
+        table_end = o + 1 + m.end("table")
+        columns = schema.get(masked[table_start:table_end])
+        if columns is None:
+            continue
+        pred = None
+        if m.group("pred") is not None:
+            pred_start = o + 1 + m.start("pred")
+            pred_end = o + 1 + m.end("pred")
+            pred_masked = masked[pred_start:pred_end]
+            if NONDETERMINISTIC.search(pred_masked) or '"' in pred_masked:
+                continue
+            if alias and re.search(r"\bselect\b", pred_masked):
+                continue
+            unqualified = pred_masked
+            if alias:
+                # The shared scan has no alias, unqualify the filter's columns
+                pieces, last = [], pred_start
+                for q in re.finditer(rf"\b{re.escape(alias)}\.", pred_masked):
+                    pieces.append(sql[last : pred_start + q.start()])
+                    last = pred_start + q.end()
+                pieces.append(sql[last:pred_end])
+                pred = "".join(pieces).strip()
+                unqualified = re.sub(rf"\b{re.escape(alias)}\.", "", pred_masked)
+            else:
+                pred = sql[pred_start:pred_end].strip()
+            # Columns qualified with anything else belong to an outer query
+            if not _is_self_contained(unqualified):
+                continue
+            if not _filter_names(unqualified, KEYWORDS) <= columns | cte_names:
+                continue
+            referenced = _referenced_ctes(pred_masked, ctes)
+        else:
+            referenced = set()
+        scans.setdefault(masked[table_start:table_end], []).append(
+            {
+                "open": o,
+                "table": (table_start, table_end),
+                "pred": pred,
+                "referenced": referenced,
+                "used": _used_columns(masked, groups, o, c, alias, columns),
+            }
+        )
+
+    edits, additions, changes = [], {}, []
+    for table, siblings in scans.items():
+        # An unfiltered sibling reads the whole table anyway
+        if len(siblings) < 2 or any(s["pred"] is None for s in siblings):
+            continue
+        index = min(_containing_cte(ctes, s["open"]) for s in siblings)
+        referenced = set().union(*(s["referenced"] for s in siblings))
+        if any(i >= index for i, (name, _, _, _) in enumerate(ctes) if name in referenced):
+            continue
+        name = _unique_name(f"_scan_{table.split('.')[-1]}", sql)
+        if any(s["used"] is None for s in siblings):
+            projection = "*"
+        else:
+            projection = ", ".join(sorted(set().union(*(s["used"] for s in siblings))))
+        preds = list(dict.fromkeys(" ".join(s["pred"].split()) for s in siblings))
+        body = (
+            f"select {projection} from {sql[siblings[0]['table'][0]:siblings[0]['table'][1]]}\nwhere "
+            + "\n   or ".join(f"({p})" for p in preds)
+        )
+        additions.setdefault(index, []).append(f"{name} as (\n{body}\n)")
+        for s in siblings:
+            edits.append((s["table"][0], s["table"][1], name))
+        changes.append(f"merged {len(siblings)} scans of {table} into {name}")
+    _insert_ctes(sql, masked, ctes, with_end, additions, edits)
+    return _apply(sql, edits), changes
+
+
+def rewrite(sql, schema=None):
+    rewritten, changes = dedupe_subqueries(sql, schema)
+    rewritten, more = merge_sibling_scans(rewritten, schema)
+    return RewriteResult(sql, rewritten, changes + more)
@@ -0,0 +1,180 @@
+import bisect
+import difflib
+import functools
+import re
+
+import pandas as pd
+
+from sql_rewrite import mask, paren_groups, top_level_ctes
+
+# Local check of editor queries against the Flipside schema data, so typos in
+# table and column names are reported before the query is submitted.
+SCHEMA_PATH = "assets/provider_schema_data.csv"
+VALIDATED_SCHEMAS = ("osmosis.core", "osmosis.mars")
+
+# Words that can appear unqualified in a query without being columns
+KEYWORDS = set(
+    """
+    select distinct all from where group by having order asc desc nulls first last limit offset qualify
+    with recursive as on using join inner left right full outer cross natural lateral union intersect except
+    minus and or not in is null true false like ilike rlike regexp between exists any some case when then
+    else end cast try_cast over partition rows range unbounded preceding following current row window
+    within interval escape collate top fetch next only pivot unpivot for sample tablesample
+    current_date current_time current_timestamp localtime localtimestamp sysdate
+    year years month months week weeks day days hour hours minute minutes second seconds quarter quarters
+    millisecond milliseconds microsecond microseconds nanosecond nanoseconds dayofweek dayofyear epoch
+    yyyy mm dd hh mi ss
+    int integer bigint smallint tinyint number numeric decimal float double real varchar char string text
+    boolean date time timestamp timestamp_ntz timestamp_ltz timestamp_tz variant object array binary
+    """.split()
+)
+
+_TABLE_REF = re.compile(r"\b(?:from|join)\s+([a-z_][\w$]*(?:\.[a-z_][\w$]*){0,2})(?:\s+(?:as\s+)?([a-z_][\w$]*))?")
+_QUALIFIED = re.compile(r"(?<![\w$.])([a-z_][\w$]*)\.([a-z_][\w$]*)\b(?!\s*\(|\s*\.)")
+_IDENTIFIER = re.compile(r"(?<![\w$.:])([a-z_][\w$]*)\b(?!\s*\(|\s*\.)")
+
+
+class ValidationResult:
+    def __init__(self, errors, warnings):
+        self.errors = errors
+        self.warnings = warnings
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+# {"osmosis.core.fact_transfers": {"block_timestamp", ...}, ...}
+@functools.lru_cache(maxsize=None)
+def load_schema(path=SCHEMA_PATH):
+    df = pd.read_csv(path, encoding="utf-8-sig")
+    schema = {}
+    for row in df.itertuples(index=False):
+        table = f"{row.table_catalog}.{row.table_schema}.{row.table_name}".lower()
+        schema.setdefault(table, set()).add(str(row.column_name).lower())
+    return schema
+
+
+def _suggestion(name, candidates, cutoff=0.6):
+    matches = difflib.get_close_matches(name, sorted(candidates), n=1, cutoff=cutoff)
+    return f" Did you mean {matches[0]}?" if matches else ""
+
+
+def _line(masked, pos):
+    return masked.count("\n", 0, pos) + 1
+
+
+def _view(masked, groups, start, end, subqueries_only=False):
+    chars = list(masked[start + 1 : end])
+    for o, c in groups:
+        if start < o and c < end:
+            if subqueries_only and not re.match(r"\s*(select|with)\b", masked[o + 1 : c]):
+                continue
+            for k in range(o + 1, c):
+                chars[k - start - 1] = " "
+    return "".join(chars)
+
+
+# Names a scope's select lists define, with or without AS:
+# `sum(amount) as total`, `sum(amount) total`, `tx_count txcount`
+def _select_aliases(text):
+    aliases = set(re.findall(r"\bas\s+([a-z_][\w$]*)", text))
+    for m in re.finditer(r"\bselect\b(.*?)(?:\bfrom\b|$)", text, re.S):
+        items, depth, last = [], 0, 0
+        select_list = m.group(1)
+        for i, ch in enumerate(select_list):
+            depth += (ch == "(") - (ch == ")")
+            if ch == "," and depth == 0:
+                items.append(select_list[last:i])
+                last = i + 1
+        items.append(select_list[last:])
+        for item in items:
+            implicit = re.search(r"(?:\b([a-z_][\w$]*)|[\w$)\]])\s+([a-z_][\w$]*)\s*$", item)
+            if implicit and implicit.group(2) not in KEYWORDS and implicit.group(1) not in KEYWORDS:
+                aliases.add(implicit.group(2))
+    return aliases
+
+
+def validate(sql, schema=None):
+    schema = load_schema() if schema is None else schema
+    masked = mask(sql)
+    # Blank quoted literals and identifiers completely, mask() only blanks
+    # their contents
+    masked = re.sub(r"'[^']*'|\"[^\"]*\"", lambda m: " " * len(m.group()), masked)
+    groups = paren_groups(masked)
+    ctes = {name for name, _, _, _ in top_level_ctes(masked, groups)[0]}
+    ctes |= set(re.findall(r"(?:\bwith|,)\s*([a-z_][\w$]*)\s*as\s*\(", masked))
+    errors, warnings = [], []
+
+    # Tables each scope reads, as {alias: table}. Sources that are not
+    # checked (CTEs, subqueries, other schemas) map to None.
+    scope_tables = []
+    for start, end in [(-1, len(masked))] + groups:
+        view = _view(masked, groups, start, end)
+        tables = {}
+        for m in _TABLE_REF.finditer(view):
+            table, alias = m.group(1), m.group(2)
+            if alias in KEYWORDS:
+                alias = None
+            short = table.rsplit(".", 1)[-1]
+            prefix = table.rsplit(".", 1)[0]
+            checked = None
+            if table.count(".") == 2 and prefix in VALIDATED_SCHEMAS:
+                if table in schema:
+                    checked = table
+                else:
+                    line = _line(masked, start + 1 + m.start(1))
+                    known = [t.rsplit(".", 1)[1] for t in schema if t.startswith(prefix + ".")]
+                    hint = _suggestion(short, known)
+                    # A close match is almost certainly a typo; anything else
+                    # may be a table newer than the local schema data
+                    if hint:
+                        errors.append(f"Line {line}: table {table} does not exist in {prefix}.{hint}")
+                    else:
+                        warnings.append(f"Line {line}: table {table} is not in the local schema data and was not checked.")
+            tables[short] = checked
+            if alias:
+                tables[alias] = checked
+        scope_tables.append((start, end, tables, view))
+
+    # Qualified columns, resolved through the innermost scope defining the
+    # alias. Scopes are the whole query and every parenthesized group.
+    starts = [start for start, _, _, _ in scope_tables]
+    for m in _QUALIFIED.finditer(masked):
+        qualifier, column = m.group(1), m.group(2)
+        if qualifier in ("osmosis", "core", "mars"):
+            continue
+        pos = m.start()
+        table = None
+        for start, end, tables, _ in reversed(scope_tables[: bisect.bisect_right(starts, pos)]):
+            if start < pos < end and qualifier in tables:
+                table = tables[qualifier]
+                break
+        if table is not None and column not in schema[table]:
+            errors.append(
+                f"Line {_line(masked, pos)}: column {qualifier}.{column} does not exist in {table}."
+                + _suggestion(column, schema[table])
+            )
+
+    # Unqualified columns of scopes that read a single known table. Only names
+    # close to one of its columns are reported, and only as warnings, since
+    # they may still be an alias or keyword the check does not recognize.
+    for start, end, tables, view in scope_tables:
+        sources = set(tables.values())
+        if len(sources) != 1 or None in sources or re.search(r"\bjoin\b|\bfrom\s+[\w$.]+(?:\s+[\w$]+)?\s*,", view):
+            continue
+        table = sources.pop()
+        text = _view(masked, groups, start, end, subqueries_only=True)
+        defined = _select_aliases(text) | set(tables) | ctes
+        for m in _IDENTIFIER.finditer(text):
+            name = m.group(1)
+            if name in KEYWORDS or name in defined or name in schema[table]:
+                continue
+            if text[: m.start()].rstrip().endswith("::"):
+                continue
+            hint = _suggestion(name, schema[table], cutoff=0.8)
+            if hint:
+                warnings.append(
+                    f"Line {_line(masked, start + 1 + m.start())}: column {name} is not in {table}.{hint}"
+                )
+    return ValidationResult(list(dict.fromkeys(errors)), list(dict.fromkeys(warnings)))
@@ -0,0 +1,110 @@
+import functools
+import gzip
+import http.server
+import threading
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+import pytest
+
+import flipside_fetch
+import result_store
+from bulk_fetch import download_result, fetch_bulk
+
+TABLE = pa.table({"BLOCK_ID": [1, 2, 3], "TX_ID": ["a", "b", "c"], "__row_index": [0, 1, 2]})
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Stand-in for the bulk results service, serving the files of a directory
+@pytest.fixture
+def server(tmp_path):
+    results = tmp_path / "results"
+    results.mkdir()
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(results)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield SimpleNamespace(url=f"http://127.0.0.1:{httpd.server_port}", dir=results)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def spill_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, "SPILL_DIR", str(tmp_path))
+    monkeypatch.setattr(flipside_fetch.with_retries, "__defaults__", (1, 0, 0, lambda s: None))
+
+
+def write_arrow(path):
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, TABLE.schema) as writer:
+        writer.write_table(TABLE)
+
+
+def write_parquet(path):
+    pq.write_table(TABLE, str(path))
+
+
+def write_csv_gz(path):
+    with gzip.open(path, "wb") as f:
+        pa_csv.write_csv(TABLE, f)
+
+
+@pytest.mark.parametrize(
+    "fmt, write", [("arrow", write_arrow), ("parquet", write_parquet), ("csv.gz", write_csv_gz)]
+)
+def test_download_decodes_each_format(server, fmt, write):
+    write(server.dir / f"run-1.{fmt}")
+    result = download_result(server.url, "run-1", fmt)
+    assert result.columns == ["block_id", "tx_id"]
+    df = result.to_pandas()
+    assert df["block_id"].tolist() == [1, 2, 3]
+    assert df["tx_id"].tolist() == ["a", "b", "c"]
+
+
+class FakeSDK:
+    def __init__(self):
+        self.pages = []
+
+    def _page(self, page_number, page_size):
+        self.pages.append((page_number, page_size))
+        records = [{"block_id": page_number}] * page_size
+        return SimpleNamespace(query_id="run-1", records=records, page=SimpleNamespace(totalPages=2))
+
+    def query(self, q, page_size, page_number):
+        return self._page(page_number, page_size)
+
+    def get_query_results(self, query_run_id, page_number, page_size):
+        return self._page(page_number, min(page_size, 2))
+
+
+def test_fetch_bulk_downloads_the_run(server):
+    write_parquet(server.dir / "run-1.parquet")
+    sdk = FakeSDK()
+    state = fetch_bulk(sdk, "select 1", server.url, "parquet")
+    assert state.error is None
+    assert state.result.num_rows == 3
+    assert sdk.pages == [(1, 1)]
+
+
+def test_fetch_bulk_falls_back_to_json_pages(server):
+    sdk = FakeSDK()
+    state = fetch_bulk(sdk, "select 1", server.url, "arrow")
+    assert state.error is None
+    assert state.result.columns == ["block_id"]
+    assert state.result.num_rows == 4
+    assert len(sdk.pages) > 1
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "feather"])
+def test_definitive_download_failures_are_not_retried(server, monkeypatch, fmt):
+    sleeps = []
+    monkeypatch.setattr(flipside_fetch.with_retries, "__defaults__", (4, 1, 1, sleeps.append))
+    state = fetch_bulk(FakeSDK(), "select 1", server.url, fmt)
+    assert state.error is None
+    assert state.result.num_rows == 4
+    assert sleeps == []
@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+from shroomdk.errors import QueryRunTimeoutError
+
+import flipside_fetch
+from flipside_fetch import fetch_pages
+
+
+class FakeSDK:
+    def __init__(self, total_pages, rows_per_page=2, fail_pages=(), error=ConnectionError("timeout")):
+        self.total_pages = total_pages
+        self.rows_per_page = rows_per_page
+        self.fail_pages = set(fail_pages)
+        self.error = error
+        self.requests = []
+
+    def _page(self, page_number):
+        self.requests.append(page_number)
+        if page_number in self.fail_pages:
+            raise self.error
+        records = [{"page": page_number, "row": i} for i in range(self.rows_per_page)]
+        return SimpleNamespace(query_id="run-1", records=records, page=SimpleNamespace(totalPages=self.total_pages))
+
+    def query(self, q, page_size, page_number):
+        return self._page(page_number)
+
+    def get_query_results(self, query_run_id, page_number, page_size):
+        return self._page(page_number)
+
+
+# A single attempt per page, without sleeping
+def no_retries(monkeypatch):
+    monkeypatch.setattr(flipside_fetch.with_retries, "__defaults__", (1, 0, 0, lambda s: None))
+
+
+def test_fetches_every_page():
+    state = fetch_pages(FakeSDK(3), "select 1")
+    assert state.error is None
+    assert state.result.num_rows == 6
+    assert state.missing_pages == []
+    assert state.truncated_pages == []
+
+
+def test_failed_page_can_be_resumed(monkeypatch):
+    no_retries(monkeypatch)
+    sdk = FakeSDK(3, fail_pages={2})
+    state = fetch_pages(sdk, "select 1")
+    assert state.missing_pages == [2, 3]
+    assert state.result.num_rows == 2
+    sdk.fail_pages.clear()
+    state = fetch_pages(sdk, "select 1", state=state)
+    assert state.error is None
+    assert state.result.num_rows == 6
+
+
+def test_timed_out_query_is_not_resubmitted(monkeypatch):
+    monkeypatch.setattr(flipside_fetch.with_retries, "__defaults__", (4, 0, 0, lambda s: None))
+    sdk = FakeSDK(3, fail_pages={1}, error=QueryRunTimeoutError(900))
+    with pytest.raises(QueryRunTimeoutError):
+        fetch_pages(sdk, "select 1")
+    assert sdk.requests == [1]
+
+
+def test_pages_past_the_limit_are_reported():
+    state = fetch_pages(FakeSDK(5), "select 1", max_pages=3)
+    assert state.error is None
+    assert state.result.num_rows == 6
+    assert state.total_pages == 3
+    assert state.available_pages == 5
+    assert state.truncated_pages == [4, 5]
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import providers
+import result_store
+from flipside_fetch import FetchCancelled, FetchState
+from providers import ProviderRouter, ResultCacheProvider
+from result_store import store_result
+
+
+@pytest.fixture(autouse=True)
+def fast_hedging(tmp_path, monkeypatch):
+    monkeypatch.setattr(providers, "DEFAULT_HEDGE_DELAY", 0.1)
+    monkeypatch.setattr(result_store, "SPILL_DIR", str(tmp_path / "spill"))
+
+
+# Fetches `pages` pages of `delay` seconds each, checking `cancel` before
+# every page like FlipsideProvider does
+class PagedProvider:
+    def __init__(self, name, pages=5, delay=0.1):
+        self.name = name
+        self.pages = pages
+        self.delay = delay
+        self.pages_fetched = 0
+        self.finished = threading.Event()
+
+    def execute(self, q, state=None, cancel=None):
+        try:
+            for _ in range(self.pages):
+                if cancel is not None and cancel.is_set():
+                    raise FetchCancelled()
+                time.sleep(self.delay)
+                self.pages_fetched += 1
+            return FetchState.finished(q, store_result(pd.DataFrame({"provider": [self.name]})))
+        finally:
+            self.finished.set()
+
+
+class FailingProvider:
+    def __init__(self, name):
+        self.name = name
+
+    def execute(self, q, state=None, cancel=None):
+        raise ConnectionError("unreachable")
+
+
+def test_losing_hedge_is_cancelled():
+    slow = PagedProvider("slow", pages=20)
+    fast = PagedProvider("fast", pages=1)
+    router = ProviderRouter([slow, fast])
+    fetch = router.execute("select 1")
+    assert fetch.provider == "fast"
+    assert slow.finished.wait(1)
+    assert slow.pages_fetched < 5
+    assert router.health["slow"].failures == 0
+
+
+def test_cache_is_not_a_candidate_without_use_cache(tmp_path):
+    cache = ResultCacheProvider(cache_dir=str(tmp_path))
+    cache.put("select 1", store_result(pd.DataFrame({"provider": ["stale"]})))
+    remote = PagedProvider("remote", pages=5)
+    router = ProviderRouter([remote, cache], cache=cache)
+    assert router.execute("select 1").provider == "Local cache"
+    fetch = router.execute("select 1", use_cache=False)
+    assert fetch.provider == "remote"
+    assert fetch.result.to_pandas()["provider"].tolist() == ["remote"]
+
+
+def test_stale_cache_is_not_a_hedge(tmp_path):
+    cache = ResultCacheProvider(cache_dir=str(tmp_path))
+    cache.put("select 1", store_result(pd.DataFrame({"provider": ["stale"]})))
+    remote = PagedProvider("remote", pages=3)
+    router = ProviderRouter([remote, cache], cache=cache, cache_ttl=0)
+    fetch = router.execute("select 1")
+    assert fetch.provider == "remote"
+    assert cache.execute("select 1").result.to_pandas()["provider"].tolist() == ["remote"]
+
+
+def test_stale_cache_is_a_failover(tmp_path):
+    cache = ResultCacheProvider(cache_dir=str(tmp_path))
+    cache.put("select 1", store_result(pd.DataFrame({"provider": ["stale"]})))
+    router = ProviderRouter([FailingProvider("remote"), cache], cache=cache, cache_ttl=0)
+    assert router.execute("select 1").provider == "Local cache"
+    with pytest.raises(providers.ProviderUnavailable):
+        router.execute("select 1", use_cache=False)
+
+
+def test_losing_hedge_that_completes_is_cached(tmp_path):
+    cache = ResultCacheProvider(cache_dir=str(tmp_path))
+    slow = PagedProvider("slow", pages=1, delay=0.3)
+    fast = PagedProvider("fast", pages=1, delay=0)
+    router = ProviderRouter([slow, fast], cache=cache)
+    assert router.execute("select 1").provider == "fast"
+    assert slow.finished.wait(1)
+
+    def cached():
+        return cache.execute("select 1").result.to_pandas()["provider"].tolist()
+
+    deadline = time.monotonic() + 1
+    while cached() != ["slow"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cached() == ["slow"]
+
+
+def test_cached_results_respect_the_memory_budget(tmp_path, monkeypatch):
+    cache = ResultCacheProvider(cache_dir=str(tmp_path))
+    cache.put("select 1", store_result(pd.DataFrame({"a": range(100000)})))
+    monkeypatch.setattr(result_store, "RESULT_MEMORY_BUDGET_MB", 0.01)
+    assert cache.execute("select 1").result.spilled
+
+
+def test_concurrent_queries_do_not_queue_into_hedges(monkeypatch):
+    monkeypatch.setattr(providers, "DEFAULT_HEDGE_DELAY", 0.5)
+    primary = PagedProvider("primary", pages=1, delay=0.3)
+    secondary = PagedProvider("secondary", pages=1, delay=0.3)
+    router = ProviderRouter([primary, secondary], max_concurrent=12)
+    threads = [threading.Thread(target=router.execute, args=(f"select {n}",)) for n in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert primary.pages_fetched == 12
+    assert secondary.pages_fetched == 0
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import result_store
+from result_store import ResultBuilder, store_result
+
+
+@pytest.fixture(autouse=True)
+def spill_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_store, "SPILL_DIR", str(tmp_path))
+    return tmp_path
+
+
+def build(frames):
+    builder = ResultBuilder(budget_mb=0.0001)
+    for frame in frames:
+        builder.append(frame)
+    return builder.finish()
+
+
+def test_small_result_stays_in_memory():
+    result = store_result(pd.DataFrame({"a": [1, 2]}))
+    assert not result.spilled
+    assert result.num_rows == 2
+
+
+def test_spilled_result_pages_and_sorts():
+    df = pd.DataFrame({"a": np.arange(1000), "b": np.arange(1000)[::-1]})
+    result = build([df.iloc[:500], df.iloc[500:]])
+    assert result.spilled
+    assert result.num_rows == 1000
+    page = result.page(1, 10, sort_by="b")
+    assert page["b"].tolist() == list(range(10, 20))
+
+
+def test_columns_that_appear_after_the_spill_are_kept():
+    result = build([pd.DataFrame({"a": [1, 2]}), pd.DataFrame({"a": [3], "b": ["x"]})])
+    df = result.to_pandas()
+    assert list(df.columns) == ["a", "b"]
+    assert df["a"].tolist() == [1, 2, 3]
+    assert df["b"].isna().tolist() == [True, True, False]
+
+
+def test_missing_columns_are_filled_with_nulls():
+    result = build([pd.DataFrame({"a": [1], "b": ["x"]}), pd.DataFrame({"a": [2]})])
+    df = result.to_pandas()
+    assert df["b"].tolist()[0] == "x"
+    assert df["b"].isna().tolist() == [False, True]
+
+
+def test_int_column_with_fractional_values_widens_to_float():
+    result = build([pd.DataFrame({"a": [1, 2]}), pd.DataFrame({"a": [1.5]})])
+    assert result.to_pandas()["a"].tolist() == [1.0, 2.0, 1.5]
+
+
+def test_all_null_column_takes_the_type_of_later_pages():
+    result = build([pd.DataFrame({"a": [None, None]}), pd.DataFrame({"a": [1.5]})])
+    values = result.to_pandas()["a"]
+    assert values.dtype == float
+    assert values.tolist()[2] == 1.5
+
+
+def test_incompatible_types_fall_back_to_string():
+    result = build([pd.DataFrame({"a": [1]}), pd.DataFrame({"a": ["x"]})])
+    assert result.to_pandas()["a"].tolist() == ["1", "x"]
+
+
+def test_release_removes_spill_files(spill_dir):
+    result = build([pd.DataFrame({"a": [1]}), pd.DataFrame({"a": [1.5]})])
+    assert len(os.listdir(spill_dir)) == 1
+    result.release()
+    assert os.listdir(spill_dir) == []
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+import scheduler
+from scheduler import DASHBOARD, EDITOR, QueryScheduler, TokenBucket
+
+
+# Stands in for the time module: sleeping advances the clock instantly
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_queries_run_by_priority_then_round_robin_across_sessions():
+    queries = QueryScheduler(max_concurrent=1)
+    release = threading.Event()
+    order = []
+    threads = [threading.Thread(target=queries.run, args=(release.wait,), kwargs={"session_id": "blocker"})]
+    threads[0].start()
+    wait_for(lambda: queries.metrics()["running"] == 1)
+    for label, session_id, priority in [
+        ("a1", "a", EDITOR),
+        ("a2", "a", EDITOR),
+        ("a3", "a", EDITOR),
+        ("b1", "b", EDITOR),
+        ("d1", "d", DASHBOARD),
+    ]:
+        thread = threading.Thread(
+            target=queries.run,
+            args=(lambda label=label: order.append(label),),
+            kwargs={"session_id": session_id, "priority": priority},
+        )
+        queued = queries.metrics()["queue_depth"]
+        thread.start()
+        wait_for(lambda: queries.metrics()["queue_depth"] == queued + 1)
+        threads.append(thread)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert order == ["d1", "a1", "b1", "a2", "a3"]
+    metrics = queries.metrics()
+    assert metrics["running"] == 0
+    assert metrics["completed"] == 6
+
+
+def test_slot_is_released_when_the_query_raises():
+    queries = QueryScheduler(max_concurrent=1)
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        queries.run(fail)
+    assert queries.metrics()["running"] == 0
+    assert queries.run(lambda: "next") == "next"
+
+
+def test_token_bucket_allows_a_burst_then_refills_at_the_rate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == []
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.5)]
+    clock.now += 10
+    for _ in range(3):
+        bucket.acquire()
+    assert len(clock.slept) == 1
@@ -0,0 +1,91 @@
+import pandas as pd
+import pytest
+
+import result_store
+import sharding
+from sharding import ShardingError, _is_closed, make_partitions, run_sharded, shard_sql
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharding, "SHARD_CACHE_DIR", str(tmp_path / "shards"))
+    monkeypatch.setattr(result_store, "SPILL_DIR", str(tmp_path / "spill"))
+
+
+def test_partitions_are_aligned_to_the_frequency():
+    partitions = make_partitions("2023-01-15", "2023-03-10", "month")
+    assert partitions == [
+        (pd.Timestamp("2023-01-15"), pd.Timestamp("2023-02-01")),
+        (pd.Timestamp("2023-02-01"), pd.Timestamp("2023-03-01")),
+        (pd.Timestamp("2023-03-01"), pd.Timestamp("2023-03-10")),
+    ]
+
+
+def test_placeholders_are_substituted():
+    sql = shard_sql(
+        "select count(*) from t where block_timestamp >= :shard_start and block_timestamp < :shard_end limit 5",
+        "block_timestamp",
+        pd.Timestamp("2023-01-01"),
+        pd.Timestamp("2023-02-01"),
+    )
+    assert sql == (
+        "select count(*) from t where block_timestamp >= '2023-01-01 00:00:00' "
+        "and block_timestamp < '2023-02-01 00:00:00' limit 5"
+    )
+
+
+def test_queries_without_placeholders_are_wrapped():
+    sql = shard_sql(
+        "select * from t where x in (select max(x) from u);", "ts", pd.Timestamp("2023-01-01"), pd.Timestamp("2023-02-01")
+    )
+    assert sql == (
+        "select * from (\nselect * from t where x in (select max(x) from u)\n) shard\n"
+        "where shard.ts >= '2023-01-01 00:00:00' and shard.ts < '2023-02-01 00:00:00'"
+    )
+
+
+@pytest.mark.parametrize(
+    "q",
+    [
+        "select * from t limit 10",
+        "select date_trunc('day', ts) as day, count(*) from t group by 1",
+        "select distinct ts from t",
+        "select max(ts) from t",
+    ],
+)
+def test_wrapping_per_partition_results_is_rejected(q):
+    with pytest.raises(ShardingError):
+        shard_sql(q, "ts", pd.Timestamp("2023-01-01"), pd.Timestamp("2023-02-01"))
+
+
+def test_ranges_are_closed_once_settled():
+    now = pd.Timestamp("2023-03-02 01:00")
+    assert not _is_closed(pd.Timestamp("2023-03-02"), now=now)
+    assert not _is_closed(pd.Timestamp("2023-03-01 02:00"), now=now)
+    assert _is_closed(pd.Timestamp("2023-03-01"), now=now)
+
+
+def test_closed_partitions_are_cached():
+    executed = []
+
+    def execute(sql):
+        executed.append(sql)
+        return pd.DataFrame({"ts": [pd.Timestamp("2023-01-01")], "n": [len(executed)]})
+
+    now = pd.Timestamp.utcnow().tz_localize(None)
+    q = "select * from t"
+    result, stats = run_sharded(q, execute, "ts", start="2023-01-01", end="2023-03-01", frequency="month")
+    assert stats == {"partitions": 2, "cached": 0, "fetched": 2}
+    assert result.num_rows == 2
+    result.release()
+    result, stats = run_sharded(q, execute, "ts", start="2023-01-01", end="2023-03-01", frequency="month")
+    assert stats == {"partitions": 2, "cached": 2, "fetched": 0}
+    assert len(executed) == 2
+    result.release()
+
+    # The current range is still open and fetched every time
+    start = (now - pd.Timedelta(days=1)).normalize()
+    for _ in range(2):
+        result, stats = run_sharded(q, execute, "ts", start=start, end=now, frequency="month")
+        assert stats["cached"] == 0
+        result.release()
@@ -0,0 +1,176 @@
+import random
+import re
+
+import pytest
+
+from dashboard_queries import MARS_TVL_SQL
+from sql_rewrite import rewrite
+
+duckdb = pytest.importorskip("duckdb")
+
+MARS_CONTRACT = "osmo1c3ljch9dfw5kf52nfwpxd2zmj2ese7agnx0p9tenkrryasrle5sqf3ftpg"
+TOKENS = {"OSMO": "uosmo", "ATOM": "ibc/atom", "USDC": "ibc/usdc", "STATOM": "ibc/statom"}
+
+
+def tutorial_query(name):
+    with open("app.py") as f:
+        return re.search(rf"{name} = '''(.*?)'''", f.read(), re.S).group(1)
+
+
+# Results of `sql` on a local DuckDB copy of the tables, as sorted rows with
+# floats rounded, so two queries can be compared regardless of row order
+def run(con, sql):
+    rows = con.execute(sql).fetchall()
+    return sorted(
+        (tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows),
+        key=repr,
+    )
+
+
+@pytest.fixture
+def con():
+    con = duckdb.connect()
+    con.execute("attach ':memory:' as osmosis")
+    con.execute("create schema osmosis.core")
+    return con
+
+
+def test_merged_staking_scans_return_the_same_rows(con):
+    rng = random.Random(1)
+    con.execute(
+        "create table osmosis.core.fact_staking(block_timestamp timestamp, delegator_address varchar, "
+        "validator_address varchar, redelegate_source_validator_address varchar, amount double, "
+        '"decimal" int, tx_succeeded varchar, action varchar)'
+    )
+    con.execute("create table osmosis.core.fact_blocks(block_timestamp timestamp)")
+    con.executemany(
+        "insert into osmosis.core.fact_staking values (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                f"2023-01-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00",
+                f"d{rng.randint(1, 40)}",
+                f"v{rng.randint(1, 5)}",
+                f"v{rng.randint(1, 5)}",
+                float(rng.randint(1, 10**6)),
+                6,
+                rng.choice(["TRUE", "FALSE"]),
+                rng.choice(["delegate", "undelegate", "redelegate", "claim"]),
+            )
+            for _ in range(3000)
+        ],
+    )
+    con.execute("insert into osmosis.core.fact_blocks values ('2023-01-20 00:00:00')")
+
+    # DuckDB wants an explicit condition on the cross join, and the final
+    # limit picks arbitrary rows
+    sql = tutorial_query("code9").replace(") b\n    group by", ") b on true\n    group by").replace("limit 20", "")
+    rewritten = rewrite(sql)
+    assert rewritten.changes == [
+        "hoisted a subquery used 2 times into _dedup_1",
+        "merged 4 scans of osmosis.core.fact_staking into _scan_fact_staking",
+    ]
+    expected = run(con, sql)
+    assert expected
+    assert run(con, rewritten.sql) == expected
+
+
+def test_merged_mars_scans_return_the_same_rows(con):
+    rng = random.Random(2)
+    con.execute(
+        "create table osmosis.core.fact_msg_attributes(block_timestamp timestamp, tx_id varchar, "
+        "msg_group int, msg_type varchar, attribute_key varchar, attribute_value varchar)"
+    )
+    con.execute('create table osmosis.core.dim_tokens(address varchar, project_name varchar, "decimal" int)')
+    con.execute("create table osmosis.core.ez_prices(recorded_hour timestamp, symbol varchar, price double)")
+    con.executemany(
+        "insert into osmosis.core.dim_tokens values (?, ?, 6)", [(address, token.lower()) for token, address in TOKENS.items()]
+    )
+    hours = [f"2023-01-01 {hour:02d}:00:00" for hour in range(24)]
+    con.executemany(
+        "insert into osmosis.core.ez_prices values (?, ?, ?)",
+        [(hour, symbol, rng.uniform(0.5, 20)) for hour in hours for symbol in list(TOKENS) + ["OTHER"]],
+    )
+    attributes = []
+    for n in range(300):
+        tx_id, hour = f"tx{n}", rng.choice(hours)
+        contract = MARS_CONTRACT if rng.random() < 0.8 else "osmo1other"
+        attributes += [
+            (hour, tx_id, 0, "message", "action", rng.choice(["borrow", "deposit", "withdraw", "repay", "claim"])),
+            (hour, tx_id, 0, "wasm", "_contract_address", contract),
+            (hour, tx_id, 0, "wasm", "amount_scaled", str(rng.randint(1, 10**9))),
+            (hour, tx_id, 0, "wasm-interests_updated", "denom", rng.choice(list(TOKENS.values()))),
+            (hour, tx_id, 0, "wasm-interests_updated", "liquidity_index", str(rng.uniform(1, 1.1))),
+        ]
+    con.executemany("insert into osmosis.core.fact_msg_attributes values (?, ?, ?, ?, ?, ?)", attributes)
+
+    # Snowflake casts the attribute strings to numbers implicitly, DuckDB
+    # does not
+    def duckdb_dialect(sql):
+        return re.sub(r"attribute_value as (amount|liquidity_index)", r"try_cast(attribute_value as double) as \1", sql)
+
+    rewritten = rewrite(MARS_TVL_SQL)
+    # The ez_prices scans include an unfiltered one, so they stay separate
+    assert rewritten.changes == ["merged 4 scans of osmosis.core.fact_msg_attributes into _scan_fact_msg_attributes"]
+    assert (
+        "select attribute_key, attribute_value, block_timestamp, msg_group, msg_type, tx_id "
+        "from osmosis.core.fact_msg_attributes"
+    ) in rewritten.sql
+    expected = run(con, duckdb_dialect(MARS_TVL_SQL))
+    assert expected
+    assert run(con, duckdb_dialect(rewritten.sql)) == expected
+
+
+def test_filter_on_a_subquery_cte_is_not_hoisted():
+    sql = """select * from (
+  with recent as (select max(block_timestamp) as ts from osmosis.core.fact_blocks)
+  select * from (select tx_id from osmosis.core.fact_transfers where block_timestamp >= (select ts from recent)) x
+  union all
+  select * from (select tx_id from osmosis.core.fact_transfers where block_timestamp < (select ts from recent)) y
+)"""
+    assert not rewrite(sql).changed
+
+
+def test_filter_on_a_select_list_alias_is_not_merged():
+    sql = """select * from
+(select tx_id, attribute_value as act from osmosis.core.fact_msg_attributes where act = 'borrow') a
+join (select tx_id, attribute_value as act from osmosis.core.fact_msg_attributes where act = 'repay') b
+on a.tx_id = b.tx_id"""
+    assert not rewrite(sql).changed
+
+
+def test_scans_of_unknown_tables_are_not_merged():
+    sql = """select * from
+(select tx_id from osmosis.core.fact_unknown where action = 'borrow') a
+join (select tx_id from osmosis.core.fact_unknown where action = 'repay') b
+on a.tx_id = b.tx_id"""
+    assert not rewrite(sql).changed
+
+
+def test_unfiltered_scan_is_not_merged():
+    sql = """select * from
+(select tx_id from osmosis.core.fact_msg_attributes where attribute_key = 'action') a
+join (select tx_id, msg_group from osmosis.core.fact_msg_attributes) b
+on a.tx_id = b.tx_id"""
+    assert not rewrite(sql).changed
+
+
+def test_correlated_subquery_is_not_hoisted():
+    sql = """select token,
+  (select max(price) from osmosis.core.ez_prices where symbol = token) as high,
+  (select max(price) from osmosis.core.ez_prices where symbol = token) / 2 as half
+from (select upper(project_name) as token from osmosis.core.dim_tokens)"""
+    assert not rewrite(sql).changed
+
+
+def test_subquery_reading_a_local_cte_is_not_hoisted(con):
+    sql = """select * from (
+  with recent as (select max(block_timestamp) as ts from osmosis.core.fact_blocks)
+  select
+    (select count(*) from recent join osmosis.core.fact_transfers on block_timestamp >= ts) as transfers,
+    (select count(*) from recent join osmosis.core.fact_transfers on block_timestamp >= ts) * 2 as doubled
+)"""
+    con.execute("create table osmosis.core.fact_blocks(block_timestamp timestamp)")
+    con.execute("create table osmosis.core.fact_transfers(block_timestamp timestamp)")
+    rewritten = rewrite(sql)
+    assert not rewritten.changed
+    assert run(con, rewritten.sql) == [(0, 0)]
@@ -0,0 +1,77 @@
+import ast
+
+import pytest
+
+import dashboard_queries
+from sql_validate import validate
+
+
+# SQL string constants of the app's tutorial, by variable name
+def tutorial_queries():
+    with open("app.py") as f:
+        tree = ast.parse(f.read())
+    return {
+        node.targets[0].id: node.value.value
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Assign)
+        and isinstance(node.targets[0], ast.Name)
+        and isinstance(node.value, ast.Constant)
+        and isinstance(node.value.value, str)
+        and "select" in node.value.value.lower()
+    }
+
+
+DASHBOARD_QUERIES = {name: sql for name, sql in vars(dashboard_queries).items() if name.endswith("_SQL")}
+
+
+@pytest.mark.parametrize("name, sql", sorted({**tutorial_queries(), **DASHBOARD_QUERIES}.items()))
+def test_app_queries_pass(name, sql):
+    result = validate(sql)
+    assert result.errors == []
+    assert result.warnings == []
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "select sum(amount) amounts from osmosis.core.fact_transfers",
+        "select max(block_timestamp) last_block_timestamp from osmosis.core.fact_blocks",
+        "select tx_count txcount from osmosis.core.fact_blocks order by txcount desc",
+        "select date_trunc('day', block_timestamp)::date as d, count(*) n from osmosis.core.fact_transfers group by d order by n",
+    ],
+)
+def test_select_list_aliases_are_defined(sql):
+    result = validate(sql)
+    assert result.errors == []
+    assert result.warnings == []
+
+
+def test_misspelled_table_is_rejected():
+    result = validate("select * from osmosis.core.fact_transfer limit 10")
+    assert result.errors == [
+        "Line 1: table osmosis.core.fact_transfer does not exist in osmosis.core. Did you mean fact_transfers?"
+    ]
+
+
+def test_misspelled_qualified_column_is_rejected():
+    result = validate(
+        "select a.amout from osmosis.core.fact_transfers a\njoin osmosis.core.fact_swaps b on a.tx_id = b.tx_idd"
+    )
+    assert result.errors == [
+        "Line 1: column a.amout does not exist in osmosis.core.fact_transfers. Did you mean amount?",
+        "Line 2: column b.tx_idd does not exist in osmosis.core.fact_swaps. Did you mean tx_id?",
+    ]
+
+
+def test_misspelled_unqualified_column_is_a_warning():
+    result = validate("select block_timestmp from osmosis.core.fact_transfers")
+    assert result.ok
+    assert result.warnings == [
+        "Line 1: column block_timestmp is not in osmosis.core.fact_transfers. Did you mean block_timestamp?"
+    ]
+
+
+def test_unknown_table_is_a_warning():
+    result = validate("select * from osmosis.core.brand_new_table")
+    assert result.ok
+    assert result.warnings == ["Line 1: table osmosis.core.brand_new_table is not in the local schema data and was not checked."]
@@ -0,0 +1,142 @@
+# Prefetch the dashboard rollups and the most frequent editor queries so the
+# first visitor after a deploy or restart does not pay for them. Run it
+# before starting the server:
+#
+#   python warmup.py --top-queries 10 && streamlit run app.py
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+from scheduler import DASHBOARD
+
+HISTORY_PATH = os.environ.get("QUERY_OSMOSIS_HISTORY", "query_history.jsonl")
+WARMUP_REPORT_PATH = os.environ.get("QUERY_OSMOSIS_WARMUP_REPORT", "warmup_report.json")
+# Also warm up inside the app on the first script run of the process
+WARMUP_ON_START = os.environ.get("QUERY_OSMOSIS_WARMUP_ON_START", "0") == "1"
+WARMUP_TOP_QUERIES = int(os.environ.get("QUERY_OSMOSIS_WARMUP_TOP_QUERIES", 0))
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+
+
+# Append an editor query to the history used to pick warm-up queries
+def record_query(q, path=HISTORY_PATH):
+    with open(path, "a") as f:
+        f.write(json.dumps({"ts": time.time(), "query": q.strip()}) + "\n")
+
+
+def most_frequent_queries(n, path=HISTORY_PATH):
+    if n <= 0 or not os.path.exists(path):
+        return []
+    counts = collections.Counter()
+    with open(path) as f:
+        for line in f:
+            try:
+                counts[json.loads(line)["query"]] += 1
+            except (ValueError, KeyError):
+                continue
+    return [q for q, _ in counts.most_common(n)]
+
+
+# Refresh the rollups that are due, then run the top editor queries through
+# the router so their results land in the result cache. The queries wait
+# for a `scheduler` slot like any other remote query. `progress(done,
+# total, label)` is called after every task.
+def warm_up(materializer, router, scheduler, top_queries=0, progress=None, history_path=HISTORY_PATH):
+    tasks = [("rollup", rollup.name, rollup) for rollup in materializer.rollups if materializer.is_due(rollup)]
+    tasks += [("editor", " ".join(q.split())[:80], q) for q in most_frequent_queries(top_queries, history_path)]
+    report = {"started_at": time.time(), "tasks": []}
+    started = time.monotonic()
+    for done, (kind, label, task) in enumerate(tasks, start=1):
+        task_started = time.monotonic()
+        error = None
+        try:
+            if kind == "rollup":
+                if not materializer.refresh(task):
+                    error = "refresh failed, see rollup status"
+            else:
+                fetch = scheduler.run(lambda: router.execute(task), session_id="warmup", priority=DASHBOARD)
+                if fetch.error is not None:
+                    error = str(fetch.error)
+        except Exception as e:
+            error = str(e)
+        report["tasks"].append(
+            {
+                "kind": kind,
+                "name": label,
+                "duration_s": round(time.monotonic() - task_started, 3),
+                "error": error,
+            }
+        )
+        if progress is not None:
+            progress(done, len(tasks), label)
+    report["duration_s"] = round(time.monotonic() - started, 3)
+    report["failed"] = sum(1 for task in report["tasks"] if task["error"])
+    return report
+
+
+def write_report(report, path=WARMUP_REPORT_PATH):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def read_report(path=WARMUP_REPORT_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# API keys come from the environment, falling back to the Streamlit secrets
+# file so the same deployment config works for both
+def load_secrets(path=SECRETS_PATH):
+    secrets = {}
+    if os.path.exists(path):
+        import toml
+
+        secrets.update(toml.load(path))
+    for key in ("API_KEY", "API_KEY_SECONDARY", "API_BASE_URL_SECONDARY"):
+        if os.environ.get(f"FLIPSIDE_{key}"):
+            secrets[key] = os.environ[f"FLIPSIDE_{key}"]
+    return secrets
+
+
+def main(argv=None):
+    from providers import build_router
+    from rollups import RollupMaterializer, remote_executor
+    from scheduler import default_scheduler
+
+    parser = argparse.ArgumentParser(description="Warm the Query Osmosis caches before serving.")
+    parser.add_argument(
+        "--top-queries",
+        type=int,
+        default=WARMUP_TOP_QUERIES,
+        help="also prefetch the N most frequent editor queries",
+    )
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--report", default=WARMUP_REPORT_PATH)
+    args = parser.parse_args(argv)
+
+    secrets = load_secrets()
+    if "API_KEY" not in secrets:
+        parser.error(f"no API key: set FLIPSIDE_API_KEY or API_KEY in {SECRETS_PATH}")
+    router = build_router(
+        secrets["API_KEY"],
+        secondary_api_key=secrets.get("API_KEY_SECONDARY"),
+        secondary_base_url=secrets.get("API_BASE_URL_SECONDARY"),
+        before_page=default_scheduler.page_permit,
+    )
+    materializer = RollupMaterializer(remote_executor(router, default_scheduler))
+
+    def progress(done, total, label):
+        print(f"[{done}/{total}] {label}", flush=True)
+
+    report = warm_up(materializer, router, default_scheduler, args.top_queries, progress, args.history)
+    write_report(report, args.report)
+    print(f"Warm-up finished in {report['duration_s']}s, {report['failed']} of {len(report['tasks'])} tasks failed")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())